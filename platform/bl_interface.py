@@ -12,16 +12,124 @@
 # DO NOT CHANGE THIS FILE
 
 import argparse
+import asyncio
+import atexit
+import fcntl
+import json
 import os
+import sys
 import logging
+import queue
 import socket
-import select
+import selectors
+import signal
+import time
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import List, Optional, TypeVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-Message = TypeVar("Message")
 LOG_FORMAT = "%(asctime)s:%(name)-s%(levelname)-8s %(message)s"
 
+# fcntl gained the pipe size constants in Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+F_GETPIPE_SZ = getattr(fcntl, "F_GETPIPE_SZ", 1032)
+SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_NONBLOCK", 0)
+
+
+# loggers only enqueue records; a listener thread does the file and terminal
+# writes, so slow disks or terminals never stall the relay
+LOG_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+LOG_HANDLER = QueueHandler(LOG_QUEUE)
+LOG_LISTENER: Optional[QueueListener] = None
+
+# per-chunk debug trace, enabled with --trace
+TRACE = False
+
+
+def start_logging():
+    global LOG_LISTENER
+    if LOG_LISTENER:
+        return
+
+    # one file handler shared by every logger; traces only go to the file
+    fhandler = logging.FileHandler("bl_interface.log")
+    fhandler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    shandler = logging.StreamHandler()
+    shandler.setLevel(logging.INFO)
+    shandler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    LOG_LISTENER = QueueListener(
+        LOG_QUEUE, fhandler, shandler, respect_handler_level=True
+    )
+    LOG_LISTENER.start()
+
+    # flush queued records on the way out
+    atexit.register(LOG_LISTENER.stop)
+
+
+def get_logger(name: str, log_level=logging.INFO) -> logging.Logger:
+    start_logging()
+    logger = logging.getLogger(name)
+    if LOG_HANDLER not in logger.handlers:
+        logger.addHandler(LOG_HANDLER)
+    logger.setLevel(log_level)
+    return logger
+
+
+def trace(sock: "Sock", peer: "Sock", n: int, dropped: bool = False):
+    action = "dropped" if dropped else "relayed"
+    sock.logger.debug(f"{n} bytes {action} {sock.sock_path} -> {peer.sock_path}")
+
+
+class SockStats:
+    """
+    Traffic accounting for one Sock
+
+    Histograms use power-of-two buckets: bucket i counts values whose
+    bit_length is i, i.e. values below 2**i. Chunk sizes are in bytes, and
+    latencies are in microseconds from receiving data on the peer to sending
+    it on this socket.
+    """
+    # set to False to keep only the byte and connection counters
+    detailed = True
+
+    HISTOGRAM_BUCKETS = 32
+
+    def __init__(self):
+        self.connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_dropped = 0
+        self.chunks_in = [0] * self.HISTOGRAM_BUCKETS
+        self.latency_us = [0] * self.HISTOGRAM_BUCKETS
+        self.latency_max_us = 0
+        self.buffer_high_water = 0
+
+    def received(self, n: int):
+        self.bytes_in += n
+        if self.detailed:
+            self.chunks_in[min(n.bit_length(), self.HISTOGRAM_BUCKETS - 1)] += 1
+
+    def buffered(self, n: int):
+        # bytes from this socket waiting in the relay for the peer
+        if n > self.buffer_high_water:
+            self.buffer_high_water = n
+
+    def delivered(self, n: int, since_ns: int):
+        self.bytes_out += n
+        if self.detailed:
+            latency = (time.perf_counter_ns() - since_ns) // 1000
+            self.latency_us[min(latency.bit_length(), self.HISTOGRAM_BUCKETS - 1)] += 1
+            if latency > self.latency_max_us:
+                self.latency_max_us = latency
+
+    def dropped(self, n: int):
+        self.bytes_dropped += n
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
 
 class Sock:
     def __init__(
@@ -34,7 +142,6 @@ class Sock:
     ):
         self.sock_path = sock_path
         self.network = network
-        self.buf = b""
 
         # set up socket
         if self.network:
@@ -58,152 +165,788 @@ class Sock:
         if mode and not self.network:
             os.chmod(sock_path, mode)
 
+        self.stats = SockStats()
+
+        # called whenever a client connects
+        self.on_open: Optional[Callable[[], None]] = None
+
         # set up logger
-        fhandler = logging.FileHandler("bl_interface.log")
-        fhandler.setLevel(log_level)
-        fhandler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.logger = get_logger(f"{sock_path}_log", log_level)
 
-        shandler = logging.StreamHandler()
-        shandler.setLevel(log_level)
-        shandler.setFormatter(logging.Formatter(LOG_FORMAT))
+    def accept(self):
+        self.csock, _ = self.sock.accept()
+        self.opened()
 
-        self.logger = logging.getLogger(f"{sock_path}_log")
-        self.logger.addHandler(fhandler)
-        self.logger.addHandler(shandler)
-        self.logger.setLevel(log_level)
+    def opened(self):
+        self.logger.info(f"Connection opened on {self.sock_path}")
+        self.stats.connections += 1
+        if self.on_open:
+            self.on_open()
 
     @staticmethod
-    def sock_ready(sock: socket.SocketType) -> bool:
-        ready, _, _ = select.select([sock], [], [], 0)
-        return bool(ready)
-
-    def active(self) -> bool:
-        # try to accept new client
-        if not self.csock:
-            if self.sock_ready(self.sock):
-                self.logger.info(f"Connection opened on {self.sock_path}")
-                self.csock, _ = self.sock.accept()
-        return bool(self.csock)
-
-    def deserialize(self) -> bytes:
-        buf = self.buf
-        self.buf = b""
-        return buf
-
-    def read_msg(self) -> Optional[Message]:
-        if not self.active():
-            return None
+    def serialize(msg: bytes) -> bytes:
+        return msg
+
+    def close(self):
+        self.logger.warning(f"Conection closed on {self.sock_path}")
+        if self.csock:
+            self.csock.close()
+        self.csock = None
+
+
+class BufferLink:
+    """
+    Preallocated ring buffer carrying one direction of a channel
+
+    Data is received straight into the ring with recv_into and sent from
+    memoryview slices of it, so relaying allocates nothing per chunk.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.view = memoryview(bytearray(size))
+        self.head = 0
+        self.pending = 0
+
+        # when the oldest pending data arrived
+        self.since = 0
+
+    @property
+    def space(self) -> int:
+        return self.size - self.pending
+
+    def fill(self, src: socket.SocketType) -> int:
+        tail = (self.head + self.pending) % self.size
+        end = self.size if tail >= self.head else self.head
+        n = src.recv_into(self.view[tail:end])
+        self.pending += n
+        return n
+
+    def drain(self, dst: socket.SocketType) -> int:
+        end = min(self.head + self.pending, self.size)
+        n = dst.send(self.view[self.head : end])
+        self.head = (self.head + n) % self.size
+        self.pending -= n
+
+        # keep the free space contiguous whenever the ring empties
+        if not self.pending:
+            self.head = 0
+        return n
+
+    def clear(self) -> int:
+        cleared = self.pending
+        self.head = 0
+        self.pending = 0
+        return cleared
+
+
+class SampleRing(BufferLink):
+    """
+    BufferLink that keeps the most recent samples while nobody drains it
+
+    While the consumer is away, new data overwrites the oldest pending data
+    instead of stopping the source, and the overwritten bytes are counted.
+    Reads go straight into the ring up to its end, so a backlog is taken in
+    large chunks and later flushed in at most two writes.
+    """
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.overwritten = 0
+
+    def wrote(self, n: int) -> int:
+        # account for n bytes written at the tail, dropping the oldest on overflow
+        self.pending += n
+        overflow = max(self.pending - self.size, 0)
+        if overflow:
+            self.head = (self.head + overflow) % self.size
+            self.pending = self.size
+            self.overwritten += overflow
+        return overflow
+
+    def overwrite(self, src: socket.SocketType) -> Tuple[int, int]:
+        tail = (self.head + self.pending) % self.size
+        n = src.recv_into(self.view[tail:])
+        return n, self.wrote(n)
+
+    def push(self, data: bytes) -> int:
+        # for callers that already hold the data in memory
+        view = memoryview(data)[-self.size :]
+        overflow = len(data) - len(view)
+        self.overwritten += overflow
+        while view:
+            tail = (self.head + self.pending) % self.size
+            n = min(len(view), self.size - tail)
+            self.view[tail : tail + n] = view[:n]
+            overflow += self.wrote(n)
+            view = view[n:]
+        return overflow
+
+    def segments(self) -> List[memoryview]:
+        end = min(self.head + self.pending, self.size)
+        first = self.view[self.head : end]
+        return [first, self.view[: self.pending - len(first)]]
+
 
+def backlog_message(ring: SampleRing) -> str:
+    message = (
+        f"Flushing {ring.pending} backlogged samples,"
+        f" {ring.overwritten} dropped while no consumer was connected"
+    )
+    ring.overwritten = 0
+    return message
+
+
+class SpliceLink:
+    """
+    Kernel pipe carrying one direction of a channel
+
+    Bytes are moved socket -> pipe -> socket with os.splice and never enter
+    user space. The pipe capacity bounds the data in flight.
+    """
+    def __init__(self, size: int):
+        self.rfd, self.wfd = os.pipe()
+        os.set_blocking(self.rfd, False)
+        os.set_blocking(self.wfd, False)
         try:
-            if self.sock_ready(self.csock):
-                data = self.csock.recv(4096)
+            fcntl.fcntl(self.wfd, F_SETPIPE_SZ, size)
+        except OSError:
+            # keep the default size if above the system limit
+            pass
+        self.size = fcntl.fcntl(self.wfd, F_GETPIPE_SZ)
+        self.pending = 0
 
-                # connection closed
-                if not data:
-                    self.close()
-                    return None
+        # when the oldest pending data arrived
+        self.since = 0
+
+    @staticmethod
+    def supported() -> bool:
+        return hasattr(os, "splice") and sys.platform.startswith("linux")
+
+    @property
+    def space(self) -> int:
+        return self.size - self.pending
+
+    def fill(self, src: socket.SocketType) -> int:
+        n = os.splice(src.fileno(), self.wfd, self.space, flags=SPLICE_FLAGS)
+        self.pending += n
+        return n
+
+    def drain(self, dst: socket.SocketType) -> int:
+        n = os.splice(self.rfd, dst.fileno(), self.pending, flags=SPLICE_FLAGS)
+        self.pending -= n
+        return n
+
+    def clear(self) -> int:
+        cleared = self.pending
+        while self.pending:
+            self.pending -= len(os.read(self.rfd, self.pending))
+        return cleared
+
+
+class Relay:
+    """
+    Event-driven relay between pairs of device-side and host-side sockets
+
+    Blocks in the selector until a listening socket has a client waiting or a
+    connected client has data, so an idle relay uses no CPU. Each Sock still
+    serves a single client at a time: its listening socket is only watched
+    while no client is connected.
+    """
+    def __init__(self, chunk_size: int = 4096):
+        self.chunk_size = chunk_size
+        self.selector = selectors.DefaultSelector()
+        self.report = None
+
+        # sock -> (peer sock, forward data to peer, hold data until peer connects)
+        self.routes: Dict[Sock, Tuple[Sock, bool, bool]] = {}
+
+        # peer sock -> socks that stopped reading until the peer connects
+        self.held: Dict[Sock, List[Sock]] = {}
+
+        # device sock -> ring keeping its latest data while the host is away
+        self.rings: Dict[Sock, SampleRing] = {}
+
+    def add_channel(
+        self,
+        device_sock: Sock,
+        host_sock: Sock,
+        to_host: bool = True,
+        to_device: bool = True,
+        hold: bool = False,
+        backlog: int = 0,
+    ):
+        self.routes[device_sock] = (host_sock, to_host, hold)
+        self.routes[host_sock] = (device_sock, to_device, hold)
+        if backlog:
+            self.rings[device_sock] = SampleRing(backlog)
+        self.listen(device_sock)
+        self.listen(host_sock)
+
+    def listen(self, sock: Sock):
+        self.selector.register(sock.sock, selectors.EVENT_READ, (self.accept, sock))
+
+    def add_control(self, control_sock: Sock, report: Callable[[], Dict[str, Any]]):
+        # every client of the control socket is sent one JSON report
+        self.report = report
+        self.selector.register(
+            control_sock.sock, selectors.EVENT_READ, (self.send_report, control_sock)
+        )
+
+    def send_report(self, control_sock: Sock, mask: int):
+        csock, _ = control_sock.sock.accept()
+        with csock:
+            csock.settimeout(1)
+            try:
+                csock.sendall(json.dumps(self.report()).encode())
+            except OSError:
+                pass
 
-                self.buf += data
+    def watch(self, sock: Sock):
+        self.selector.register(sock.csock, selectors.EVENT_READ, (self.relay, sock))
 
-            return self.deserialize()
+    def accept(self, sock: Sock, mask: int):
+        # single client: stop accepting until this one disconnects
+        self.selector.unregister(sock.sock)
+        sock.accept()
+        self.watch(sock)
+
+        # resume sockets that were waiting for this one
+        for waiting in self.held.pop(sock, []):
+            if waiting.csock:
+                self.watch(waiting)
+
+        # hand over whatever was kept while this client was away
+        peer = self.routes[sock][0]
+        ring = self.rings.get(peer)
+        if ring and ring.pending:
+            sock.logger.warning(backlog_message(ring))
+            self.flush(peer, sock, ring)
+
+    def flush(self, sock: Sock, peer: Sock, ring: SampleRing):
+        while ring.pending:
+            try:
+                peer.stats.delivered(ring.drain(peer.csock), ring.since)
+            except (ConnectionResetError, BrokenPipeError):
+                self.close(peer)
+                return
+
+    def relay_ring(self, sock: Sock, mask: int):
+        peer = self.routes[sock][0]
+        ring = self.rings[sock]
+        try:
+            n, overwritten = ring.overwrite(sock.csock)
         except (ConnectionResetError, BrokenPipeError):
-            # cleanly handle forced closed connection
-            self.close()
-            return None
-
-    def read_all_msgs(self) -> List[Message]:
-        msgs = []
-        msg = self.read_msg()
-        while msg:
-            msgs.append(msg)
-            msg = self.read_msg()
-        return msgs
+            n, overwritten = 0, 0
 
-    @staticmethod
-    def serialize(msg: bytes) -> bytes:
-        return msg
+        # connection closed
+        if not n:
+            self.close(sock)
+            return
+        sock.stats.received(n)
+        sock.stats.buffered(ring.pending)
+        sock.stats.dropped(overwritten)
+        if ring.pending == n:
+            ring.since = time.perf_counter_ns()
+        if TRACE:
+            trace(sock, peer, n, dropped=bool(overwritten))
+
+        if peer.csock:
+            self.flush(sock, peer, ring)
 
-    def send_msg(self, msg: Message) -> bool:
-        if not self.active():
-            return False
+    def relay(self, sock: Sock, mask: int):
+        if sock in self.rings:
+            self.relay_ring(sock, mask)
+            return
+        peer, forward, hold = self.routes[sock]
+
+        # leave data queued in the kernel until the peer shows up
+        if forward and hold and not peer.csock:
+            self.selector.unregister(sock.csock)
+            self.held.setdefault(peer, []).append(sock)
+            return
 
         try:
-            self.csock.sendall(self.serialize(msg))
-            return True
+            data = sock.csock.recv(self.chunk_size)
         except (ConnectionResetError, BrokenPipeError):
-            # cleanly handle forced closed connection
-            self.close()
-            return False
+            data = b""
 
-    def close(self):
-        self.logger.warning(f"Conection closed on {self.sock_path}")
-        self.csock = None
-        self.buf = b""
+        # connection closed
+        if not data:
+            self.close(sock)
+            return
+        received = time.perf_counter_ns()
+        sock.stats.received(len(data))
+
+        # data with nowhere to go is dropped
+        if forward and peer.csock:
+            sock.stats.buffered(len(data))
+            try:
+                peer.csock.sendall(peer.serialize(data))
+                peer.stats.delivered(len(data), received)
+            except (ConnectionResetError, BrokenPipeError):
+                self.close(peer)
+            if TRACE:
+                trace(sock, peer, len(data))
+        elif forward:
+            sock.stats.dropped(len(data))
+            if TRACE:
+                trace(sock, peer, len(data), dropped=True)
+
+    def close(self, sock: Sock):
+        try:
+            self.selector.unregister(sock.csock)
+        except KeyError:
+            # held sockets are not registered
+            for waiting in self.held.values():
+                if sock in waiting:
+                    waiting.remove(sock)
+        sock.close()
+        self.listen(sock)
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select():
+                # skip events for sockets closed earlier in this batch
+                if self.selector.get_map().get(key.fd) is not key:
+                    continue
+                callback, sock = key.data
+                callback(sock, mask)
 
 
-def poll_data_socks(device_sock: Sock, host_sock: Sock):
-    if device_sock.active():
-        msg = device_sock.read_msg()
+class ZeroCopyRelay(Relay):
+    """
+    Relay that moves data through a bounded link per channel direction
 
-        # send message to host
-        if host_sock.active():
-            if msg is not None:
-                host_sock.send_msg(msg)
+    All client sockets are non-blocking. When a destination cannot take more
+    data, the link holds the remainder, the destination is watched for
+    writability and its source stops being read once the link is full, so a
+    slow peer never blocks the relay.
+    """
+    def __init__(self, link_size: int = 65536, splice: Optional[bool] = None):
+        super().__init__()
+        if splice is None:
+            splice = SpliceLink.supported()
+        link_type = SpliceLink if splice else BufferLink
+        self.link_size = link_size
+        self.link_type = link_type
 
-    if host_sock.active():
-        msg = host_sock.read_msg()
+        # source sock -> link carrying its data to the peer; SampleRing links
+        # keep the latest data instead of pausing the source while the peer
+        # is away
+        self.links: Dict[Sock, Union[BufferLink, SpliceLink]] = {}
 
-        # send message to device
-        if device_sock.active():
-            if msg is not None:
-                device_sock.send_msg(msg)
+        # receive buffer for data that is read only to be dropped
+        self.scratch = memoryview(bytearray(link_size))
 
+    def add_channel(
+        self,
+        device_sock: Sock,
+        host_sock: Sock,
+        to_host: bool = True,
+        to_device: bool = True,
+        hold: bool = False,
+        backlog: int = 0,
+    ):
+        super().add_channel(device_sock, host_sock, to_host, to_device, hold, backlog)
+        self.links[device_sock] = self.rings.get(device_sock) or self.link_type(
+            self.link_size
+        )
+        self.links[host_sock] = self.link_type(self.link_size)
+
+    def update(self, sock: Sock):
+        # watch a client for whatever its links currently allow
+        if not sock.csock:
+            return
+        peer, forward, hold = self.routes[sock]
 
-def poll_restart_socks(device_sock: Sock, host_sock: Sock):
-    # First check that device opened a restart port
-    if device_sock.active():
-        # Send host restart commands to device
-        if host_sock.active():
-            msg = host_sock.read_msg()
-            if msg is not None:
-                device_sock.send_msg(msg)
+        events = 0
+        if not forward or not (hold and not peer.csock):
+            if self.links[sock].space or (sock in self.rings and not peer.csock):
+                events |= selectors.EVENT_READ
+        if self.links[peer].pending:
+            events |= selectors.EVENT_WRITE
 
+        try:
+            key = self.selector.get_key(sock.csock)
+        except KeyError:
+            key = None
+
+        if key and events:
+            if key.events != events:
+                self.selector.modify(sock.csock, events, key.data)
+        elif key:
+            self.selector.unregister(sock.csock)
+        elif events:
+            self.selector.register(sock.csock, events, (self.relay, sock))
 
-def poll_sc_socks(device_sock: Sock, host_sock: Sock):
-    # First check that device opened a side-channel port
-    if device_sock.active():
-        msg = device_sock.read_msg()
+    def accept(self, sock: Sock, mask: int):
+        # single client: stop accepting until this one disconnects
+        self.selector.unregister(sock.sock)
+        sock.accept()
+        sock.csock.setblocking(False)
 
-        # Send data to host
-        if host_sock.active():
-            if msg is not None:
-                host_sock.send_msg(msg)
+        # whatever was kept while this client was away goes out as it drains
+        peer = self.routes[sock][0]
+        ring = self.rings.get(peer)
+        if ring and ring.pending:
+            sock.logger.warning(backlog_message(ring))
+
+        self.update(sock)
+        self.update(peer)
+
+    def relay(self, sock: Sock, mask: int):
+        peer, forward, _ = self.routes[sock]
+        try:
+            if mask & selectors.EVENT_WRITE:
+                link = self.links[peer]
+                sock.stats.delivered(link.drain(sock.csock), link.since)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except (ConnectionResetError, BrokenPipeError):
+            self.close(sock)
+            return
+
+        try:
+            if mask & selectors.EVENT_READ:
+                link = self.links[sock]
+                overwritten = 0
+                if sock in self.rings and not peer.csock:
+                    n, overwritten = self.rings[sock].overwrite(sock.csock)
+                elif forward:
+                    n = link.fill(sock.csock)
+                else:
+                    n = sock.csock.recv_into(self.scratch)
+
+                # connection closed
+                if not n:
+                    self.close(sock)
+                    return
+                sock.stats.received(n)
+                sock.stats.dropped(overwritten)
+                if forward:
+                    sock.stats.buffered(link.pending)
+                    if link.pending == n:
+                        link.since = time.perf_counter_ns()
+                    if TRACE:
+                        trace(sock, peer, n, dropped=not peer.csock)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except (ConnectionResetError, BrokenPipeError):
+            self.close(sock)
+            return
+
+        # push new data straight on, or drop it if there is nowhere to go
+        link = self.links[sock]
+        if link.pending:
+            if peer.csock:
+                try:
+                    peer.stats.delivered(link.drain(peer.csock), link.since)
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except (ConnectionResetError, BrokenPipeError):
+                    self.close(peer)
+            elif sock not in self.rings:
+                sock.stats.dropped(link.clear())
+
+        self.update(sock)
+        self.update(peer)
+
+    def close(self, sock: Sock):
+        peer = self.routes[sock][0]
+        try:
+            self.selector.unregister(sock.csock)
+        except KeyError:
+            pass
+
+        # data still on its way to this client is lost with it, unless a
+        # backlog ring keeps it for the next one
+        if peer not in self.rings:
+            peer.stats.dropped(self.links[peer].clear())
+        sock.close()
+        self.listen(sock)
+        self.update(peer)
+
+
+class AsyncRelay:
+    """
+    asyncio relay where every channel direction is pumped by its own task
+
+    Each connected client's writer has a high/low watermark. A pump that
+    finds its peer above the high-water mark awaits until the peer drains
+    below the low-water mark, pausing reads on that direction only, so a
+    slow host client never stalls the other channels.
+    """
+    def __init__(
+        self,
+        high_water: int = 65536,
+        low_water: int = 16384,
+        chunk_size: int = 65536,
+    ):
+        self.high_water = high_water
+        self.low_water = low_water
+        self.chunk_size = chunk_size
+
+        # sock -> (peer sock, forward data to peer, hold data until peer connects)
+        self.routes: Dict[Sock, Tuple[Sock, bool, bool]] = {}
+        self.writers: Dict[Sock, asyncio.StreamWriter] = {}
+        self.connected: Dict[Sock, asyncio.Event] = {}
+
+        # device sock -> ring keeping its latest data while the host is away
+        self.rings: Dict[Sock, SampleRing] = {}
+        self.control: Optional[Tuple[Sock, Callable[[], Dict[str, Any]]]] = None
+
+    def add_channel(
+        self,
+        device_sock: Sock,
+        host_sock: Sock,
+        to_host: bool = True,
+        to_device: bool = True,
+        hold: bool = False,
+        backlog: int = 0,
+    ):
+        self.routes[device_sock] = (host_sock, to_host, hold)
+        self.routes[host_sock] = (device_sock, to_device, hold)
+        if backlog:
+            self.rings[device_sock] = SampleRing(backlog)
+
+    async def serve(self, sock: Sock):
+        # single client: later clients wait on the lock, like the listen backlog
+        lock = asyncio.Lock()
+        connected = self.connected[sock]
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            async with lock:
+                writer.transport.set_write_buffer_limits(
+                    high=self.high_water, low=self.low_water
+                )
+                self.writers[sock] = writer
+                sock.opened()
+                connected.set()
+                try:
+                    await self.flush(sock, writer)
+                    await self.pump(sock, reader)
+                finally:
+                    connected.clear()
+                    del self.writers[sock]
+                    sock.logger.warning(f"Conection closed on {sock.sock_path}")
+                    writer.close()
+
+        if sock.network:
+            server = await asyncio.start_server(
+                handle, sock=sock.sock, limit=self.high_water
+            )
+        else:
+            server = await asyncio.start_unix_server(
+                handle, sock=sock.sock, limit=self.high_water
+            )
+        await server.serve_forever()
+
+    async def flush(self, sock: Sock, writer: asyncio.StreamWriter):
+        # hand over whatever was kept while this client was away
+        ring = self.rings.get(self.routes[sock][0])
+        if ring and ring.pending:
+            sock.logger.warning(backlog_message(ring))
+            pending = ring.pending
+            for segment in ring.segments():
+                writer.write(bytes(segment))
+            ring.clear()
+            await writer.drain()
+            sock.stats.delivered(pending, ring.since)
+
+    async def pump(self, sock: Sock, reader: asyncio.StreamReader):
+        peer, forward, hold = self.routes[sock]
+        while True:
+            # leave data queued until the peer shows up
+            if forward and hold:
+                await self.connected[peer].wait()
+
+            try:
+                data = await reader.read(self.chunk_size)
+            except (ConnectionResetError, BrokenPipeError):
+                data = b""
+
+            # connection closed
+            if not data:
+                return
+            received = time.perf_counter_ns()
+            sock.stats.received(len(data))
+
+            # data with nowhere to go is dropped
+            writer = self.writers.get(peer)
+            ring = self.rings.get(sock)
+            if TRACE and forward:
+                trace(sock, peer, len(data), dropped=not writer)
+            if ring and not writer:
+                if not ring.pending:
+                    ring.since = received
+                sock.stats.dropped(ring.push(data))
+                sock.stats.buffered(ring.pending)
+            elif forward and not writer:
+                sock.stats.dropped(len(data))
+            elif forward:
+                writer.write(peer.serialize(data))
+                sock.stats.buffered(writer.transport.get_write_buffer_size())
+                try:
+                    # only blocks this direction, and only above the high-water mark
+                    await writer.drain()
+                    peer.stats.delivered(len(data), received)
+                except (ConnectionResetError, BrokenPipeError):
+                    pass
+
+    def add_control(self, control_sock: Sock, report: Callable[[], Dict[str, Any]]):
+        self.control = (control_sock, report)
+
+    async def serve_control(self):
+        control_sock, report = self.control
+
+        # every client of the control socket is sent one JSON report
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            writer.write(json.dumps(report()).encode())
+            writer.close()
+
+        server = await asyncio.start_unix_server(handle, sock=control_sock.sock)
+        await server.serve_forever()
+
+    async def serve_all(self):
+        # events must be created inside the running loop
+        self.connected = {sock: asyncio.Event() for sock in self.routes}
+        servers = [self.serve(sock) for sock in self.routes]
+        if self.control:
+            servers.append(self.serve_control())
+        serving = asyncio.ensure_future(asyncio.gather(*servers))
+
+        # SIGTERM stops the servers from inside the loop, rather than raising
+        # SystemExit through it, and the clients are closed on the way out
+        stopping = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        stopped = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait([serving, stopped], return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        serving.cancel()
+        for writer in list(self.writers.values()):
+            writer.close()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+
+    def run(self):
+        asyncio.run(self.serve_all())
+
+
+class Instance:
+    """
+    Sockets for one emulated device: data, restart and optional side-channel
+    """
+    def __init__(
+        self,
+        name: str,
+        data_bl_sock: str,
+        data_host_sock: Union[int, str],
+        restart_bl_sock: str,
+        restart_host_sock: str,
+        sc_bl_sock: Optional[str] = None,
+        sc_host_sock: Optional[str] = None,
+    ):
+        self.name = name
+        self.logger = get_logger(f"{name}_log")
+
+        # open all sockets
+        self.data_bl = Sock(str(data_bl_sock), mode=0o777)
+        self.data_host = Sock(str(data_host_sock), mode=0o777, network=True)
+
+        self.restart_bl = Sock(str(restart_bl_sock), mode=0o777)
+        self.restart_host = Sock(str(restart_host_sock), mode=0o777)
+
+        self.sc_bl = None
+        self.sc_host = None
+        if sc_bl_sock and sc_host_sock:
+            self.sc_bl = Sock(str(sc_bl_sock), mode=0o777)
+            self.sc_host = Sock(str(sc_host_sock), mode=0o777)
+
+    def attach(self, relay: Union[Relay, AsyncRelay], sc_backlog: int = 0):
+        relay.add_channel(self.data_bl, self.data_host)
+
+        # restart commands only flow to the device, and wait for it to connect
+        relay.add_channel(self.restart_bl, self.restart_host, to_host=False, hold=True)
+
+        # side-channel data only flows to the host, and the latest samples are
+        # kept while no collector is connected
+        if self.sc_bl:
+            relay.add_channel(
+                self.sc_bl, self.sc_host, to_device=False, backlog=sc_backlog
+            )
+
+    def channels(self) -> Dict[str, Tuple[Sock, Sock]]:
+        channels = {
+            "data": (self.data_bl, self.data_host),
+            "restart": (self.restart_bl, self.restart_host),
+        }
+        if self.sc_bl:
+            channels["sc"] = (self.sc_bl, self.sc_host)
+        return channels
+
+    def device_socks(self) -> List[Sock]:
+        # the sockets the emulator connects to when it boots
+        return [self.data_bl, self.restart_bl]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {"device": bl.stats.as_dict(), "host": host.stats.as_dict()}
+            for name, (bl, host) in self.channels().items()
+        }
+
+    def log_stats(self):
+        for name, (bl, host) in self.channels().items():
+            self.logger.info(
+                f"{name}: device->host {bl.stats.bytes_in} bytes in, "
+                f"{host.stats.bytes_out} out, {bl.stats.bytes_dropped} dropped; "
+                f"host->device {host.stats.bytes_in} bytes in, "
+                f"{bl.stats.bytes_out} out, {host.stats.bytes_dropped} dropped; "
+                f"connections {bl.stats.connections}/{host.stats.connections}"
+            )
+
+
+def write_ready(path: Path):
+    # written in full and renamed into place so waiters never see a partial file
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(f"{os.getpid()}\n")
+    os.replace(tmp, path)
+
+
+def load_manifest(manifest: Path) -> List[Instance]:
+    # manifest is a JSON list of objects taking the same keys as the socket
+    # arguments, e.g. {"name": "dev0", "data_bl_sock": "...", ...}
+    entries = json.loads(manifest.read_text())
+    return [
+        Instance(**{"name": f"device{i}", **entry}) for i, entry in enumerate(entries)
+    ]
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="JSON list of device instances to relay instead of the socket args",
+    )
     parser.add_argument(
         "--data-bl-sock",
         type=Path,
-        required=True,
         help="Path to device-side data socket (will be created)",
     )
     parser.add_argument(
         "--data-host-sock",
         type=int,
-        required=True,
         help="Port for host-side data socket (must be available)",
     )
     parser.add_argument(
         "--restart-bl-sock",
         type=Path,
-        required=True,
         help="Path to device-side data socket (will be created)",
     )
     parser.add_argument(
         "--restart-host-sock",
         type=Path,
-        required=True,
         help="Path to host-side data socket (will be created)",
     )
     parser.add_argument(
@@ -216,27 +959,170 @@ def parse_args():
         type=Path,
         help="Path to the host-side side-channel socket (will be created)",
     )
-    return parser.parse_args()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--zero-copy",
+        action="store_true",
+        help="Relay through bounded preallocated buffers (spliced where supported)",
+    )
+    mode.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Relay each channel direction independently with asyncio",
+    )
+    parser.add_argument(
+        "--link-size",
+        type=int,
+        default=65536,
+        help="Bytes buffered per channel direction in --zero-copy mode",
+    )
+    parser.add_argument(
+        "--high-water",
+        type=int,
+        default=65536,
+        help="Buffered bytes at which --asyncio mode pauses a direction",
+    )
+    parser.add_argument(
+        "--low-water",
+        type=int,
+        default=16384,
+        help="Buffered bytes at which --asyncio mode resumes a direction",
+    )
+    parser.add_argument(
+        "--sc-backlog",
+        type=int,
+        default=0,
+        help="Most recent side-channel samples kept while no collector is"
+        " connected (default 0 drops them, so a new collector only sees new"
+        " samples)",
+    )
+    parser.add_argument(
+        "--control-sock",
+        type=Path,
+        help="Path to a UNIX socket serving relay metrics as JSON (will be created)",
+    )
+    parser.add_argument(
+        "--ready-file",
+        type=Path,
+        help="File to create once every listening socket is bound",
+    )
+    parser.add_argument(
+        "--device-ready-file",
+        type=Path,
+        help="File to create once every device has connected its data and"
+        " restart sockets",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Log every relayed chunk to bl_interface.log",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="Only count bytes and connections, without histograms or latency",
+    )
+    args = parser.parse_args()
+
+    required = [
+        "data_bl_sock",
+        "data_host_sock",
+        "restart_bl_sock",
+        "restart_host_sock",
+    ]
+    if not args.manifest and not all(getattr(args, arg) for arg in required):
+        parser.error("the socket arguments are required without --manifest")
+    return args
 
 
 def main():
+    global TRACE
     args = parse_args()
 
+    # never leave a previous run's readiness behind
+    ready_files = [path for path in (args.ready_file, args.device_ready_file) if path]
+    for path in ready_files:
+        if path.exists():
+            path.unlink()
+
     # open all sockets
-    data_bl = Sock(str(args.data_bl_sock), mode=0o777)
-    data_host = Sock(str(args.data_host_sock), mode=0o777, network=True)
+    if args.manifest:
+        instances = load_manifest(args.manifest)
+    else:
+        instances = [
+            Instance(
+                "device",
+                args.data_bl_sock,
+                args.data_host_sock,
+                args.restart_bl_sock,
+                args.restart_host_sock,
+                args.sc_bl_sock,
+                args.sc_host_sock,
+            )
+        ]
+
+    if args.zero_copy:
+        relay = ZeroCopyRelay(args.link_size)
+    elif args.asyncio:
+        relay = AsyncRelay(args.high_water, args.low_water)
+    else:
+        relay = Relay()
+    for instance in instances:
+        instance.attach(relay, args.sc_backlog)
+
+    SockStats.detailed = not args.no_metrics
+    if args.trace:
+        TRACE = True
+        for instance in instances:
+            for socks in instance.channels().values():
+                for sock in socks:
+                    sock.logger.setLevel(logging.DEBUG)
+    if args.control_sock:
+        started = time.time()
+        control_sock = Sock(str(args.control_sock), q_len=8, mode=0o777)
+        relay.add_control(
+            control_sock,
+            lambda: {
+                "uptime": time.time() - started,
+                "instances": {i.name: i.stats() for i in instances},
+            },
+        )
+
+    # log per-instance accounting on request and on the way out
+    def log_stats(*_):
+        for instance in instances:
+            instance.log_stats()
+
+    signal.signal(signal.SIGUSR1, log_stats)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    # the device is usable once the emulator has connected to it
+    if args.device_ready_file:
+        device_socks = [
+            sock for instance in instances for sock in instance.device_socks()
+        ]
+
+        def device_opened():
+            if all(sock.stats.connections for sock in device_socks):
+                write_ready(args.device_ready_file)
+                for sock in device_socks:
+                    sock.on_open = None
 
-    restart_bl = Sock(str(args.restart_bl_sock), mode=0o777)
-    restart_host = Sock(str(args.restart_host_sock), mode=0o777)
+        for sock in device_socks:
+            sock.on_open = device_opened
 
-    sc_bl = Sock(str(args.sc_bl_sock), mode=0o777)
-    sc_host = Sock(str(args.sc_host_sock), mode=0o777)
+    # every listener is bound, so clients can connect from here on
+    if args.ready_file:
+        write_ready(args.ready_file)
 
-    # poll sockets forever
-    while True:
-        poll_data_socks(data_bl, data_host)
-        poll_restart_socks(restart_bl, restart_host)
-        poll_sc_socks(sc_bl, sc_host)
+    # relay sockets forever
+    try:
+        relay.run()
+    finally:
+        log_stats()
+        for path in ready_files:
+            if path.exists():
+                path.unlink()
 
 
 if __name__ == "__main__":
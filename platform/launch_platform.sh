@@ -48,6 +48,7 @@ fi
 ext_sock_root="/external_socks"
 ext_restart_sock="$ext_sock_root/restart.sock"
 ext_sc_sock="$ext_sock_root/sc_probe.sock"
+ext_ready="$ext_sock_root/ready"
 net_uart_sock="$uart_sock"
 
 # Setup internal emulator sockets
@@ -55,6 +56,7 @@ int_sock_root="/internal_socks"
 int_host_sock="$int_sock_root/host.sock"
 int_restart_sock="$int_sock_root/restart.sock"
 int_sc_sock="/socks/sc_probe.sock"
+int_ready="$int_sock_root/ready"
 mkdir "$int_sock_root"
 
 # Spin up the interface
@@ -67,16 +69,29 @@ if [ ! -z ${do_sc} ]; then
     --restart-bl-sock "$int_restart_sock" \
     --restart-host-sock "$ext_restart_sock" \
     --sc-bl-sock "$int_sc_sock" \
-    --sc-host-sock "$ext_sc_sock" &
+    --sc-host-sock "$ext_sc_sock" \
+    --ready-file "$int_ready" \
+    --device-ready-file "$ext_ready" &
 else
   python3 -u /platform/bl_interface.py --data-bl-sock "$int_host_sock" \
     --data-host-sock "$net_uart_sock" \
     --restart-bl-sock "$int_restart_sock" \
-    --restart-host-sock "$ext_restart_sock" &
+    --restart-host-sock "$ext_restart_sock" \
+    --ready-file "$int_ready" \
+    --device-ready-file "$ext_ready" &
 fi
+bl_pid=$!
 
-# Give time for the sockets and eFuse to initialize
-sleep 2
+# Wait for the interface to bind its sockets (up to 10 seconds)
+tries=200
+while [ ! -e "$int_ready" ]; do
+  if ! kill -0 $bl_pid 2>/dev/null || [ $tries -eq 0 ]; then
+    echo "Bootloader interface failed to start"
+    exit 1
+  fi
+  tries=$((tries - 1))
+  sleep 0.05
+done
 
 # Spin up the emulator -- correct version (side-channel or not) is selected by makefile
 qemu-system-arm -M lm3s6965evb -nographic -monitor none \
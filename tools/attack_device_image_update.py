@@ -12,12 +12,17 @@
 import argparse
 from pathlib import Path
 from serial import Serial
-from serial.tools import list_ports
+
+from serial_discovery import wait_for_ports
+from update_protocol import ERROR, IGNORE, BlockStream, read_image, response_table
 
 
 success_codes = [1, 2, 3, 5, 6, 7, 9, 10, 12, 13, 15, 18, 21, 22, 23]
 error_codes = [4, 11, 14, 16, 17, 19, 20]
 
+# bytes that are neither success nor error codes are line noise and skipped
+RESPONSES = response_table(success_codes, error_codes, others=IGNORE)
+
 UPDATE_COMMAND = b"\x00"
 
 
@@ -25,9 +30,9 @@ UPDATE_COMMAND = b"\x00"
 # Exit if response does not match
 def verify_resp(ser, print_out=True):
     resp = ser.read(1)
-    while (resp == b"") or (not ord(resp) in (success_codes + error_codes)):
+    while (resp == b"") or (RESPONSES[ord(resp)] == IGNORE):
         resp = ser.read(1)
-    if ord(resp) not in success_codes:
+    if RESPONSES[ord(resp)] == ERROR:
         print(f"Error. Bootloader responded with: {ord(resp)}")
         exit()
     if print_out:
@@ -37,7 +42,7 @@ def verify_resp(ser, print_out=True):
 
 
 # Run full application update
-def image_update(in_file):
+def image_update(in_file, window=1):
 
     # USAGE:
     #   1. Start this script
@@ -49,22 +54,7 @@ def image_update(in_file):
 
     # Look for a serial port to open
     print("Looking for new serial port to open...")
-    search = True
-    orig_port_list = list_ports.comports()
-    orig_len = len(orig_port_list)
-    while search:
-        new_port_list = list_ports.comports()
-        new_len = len(new_port_list)
-        if new_len == (orig_len + 1):
-            for port in new_port_list:
-                if port not in orig_port_list:
-                    com_port = port.device
-                    search = False
-                    break
-        elif new_len != orig_len:
-            # Something changed, so we adapt
-            orig_port_list = new_port_list
-            orig_len = new_len
+    com_port = wait_for_ports()[0]
 
     # Keep trying to connect
     while 1:
@@ -83,38 +73,42 @@ def image_update(in_file):
         print(f"Image file {img_file} not found. Exiting")
         exit()
 
-    with open(img_file, "rb") as image_fp:
-
-        # Send update command
-        print("Requesting update")
-        ser.write(UPDATE_COMMAND)
-
-        # Wait for initial status messages to synchronize
-        resp = -1
-        while resp != success_codes[2]:
-            resp = verify_resp(ser)
-
-        # Send image and verify each block success
-        print("Update started")
-        print("Sending image data")
-        block_bytes = image_fp.read(16)
-        count = 0
-        while block_bytes != b"":
-            if (count % 100) == 0:
-                print(f"Sending block {count}")
-            count += 1
-
-            ser.write(block_bytes)
-            verify_resp(ser, print_out=False)
-            block_bytes = image_fp.read(16)
+    image = read_image(img_file)
+
+    # Send update command
+    print("Requesting update")
+    ser.write(UPDATE_COMMAND)
+
+    # Wait for initial status messages to synchronize
+    resp = -1
+    while resp != success_codes[2]:
+        resp = verify_resp(ser)
+
+    # Send image and verify each block success
+    print("Update started")
+    print("Sending image data")
+
+    def sent(count: int, total: int):
+        if (count % 100) == 0:
+            print(f"Sent block {count}")
+
+    stream = BlockStream(ser, image, window=window, progress=sent)
+    failed = stream.send(RESPONSES)
+    if failed is not None:
+        # a timeout with several blocks in flight leaves no response byte
+        if stream.resp:
+            print(f"Error. Bootloader responded with: {ord(stream.resp)}")
+        else:
+            print(f"Error. No response to block {failed} (timeout)")
+        exit()
 
-        # Wait for update finish
-        print("\nListening for update status...\n")
-        resp = -1
-        while resp != success_codes[-1]:
-            resp = verify_resp(ser)
+    # Wait for update finish
+    print("\nListening for update status...\n")
+    resp = -1
+    while resp != success_codes[-1]:
+        resp = verify_resp(ser)
 
-        print("\nUpdate Complete!\n")
+    print("\nUpdate Complete!\n")
 
 
 # Run in application mode
@@ -125,6 +119,12 @@ if __name__ == "__main__":
         description="Tool for loading designs into the keyed attack-phase device",
     )
     parser.add_argument("--infile", required=True, help="Path to the input binary")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=1,
+        help="Blocks to keep in flight (default: 1, stop-and-wait)",
+    )
 
     args = parser.parse_args()
-    image_update(args.infile)
+    image_update(args.infile, args.window)
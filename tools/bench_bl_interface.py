@@ -0,0 +1,354 @@
+# 2022 eCTF
+# Bootloader Interface Benchmark
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+
+log = logging.getLogger(Path(__file__).name)
+
+ROOT_PATH = Path(__file__, "..", "..").resolve()
+BL_INTERFACE = ROOT_PATH / "platform" / "bl_interface.py"
+
+CHUNK_SIZE = 4096
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> float:
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    stat = Path(f"/proc/{pid}/stat").read_text()
+    fields = stat[stat.rindex(")") + 2 :].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def connect_unix(path: Path, timeout: float = 5) -> socket.socket:
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(path))
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def connect_tcp(port: int, timeout: float = 5) -> socket.socket:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+class Clients:
+    """
+    Device-side and host-side clients of one relayed device instance
+    """
+    def __init__(self, root: Path, port: int):
+        # the device side connects first, like qemu does
+        self.data_bl = connect_unix(root / "data_bl.sock")
+        self.restart_bl = connect_unix(root / "restart_bl.sock")
+        self.sc_bl = connect_unix(root / "sc_bl.sock")
+        self.data_host = connect_tcp(port)
+        self.restart_host = connect_unix(root / "restart_host.sock")
+        self.sc_host = connect_unix(root / "sc_host.sock")
+
+        # make sure every connection has been accepted before measuring
+        self.data_bl.sendall(b"!")
+        self.data_host.recv(1)
+
+    def close(self):
+        for sock in (
+            self.data_bl,
+            self.restart_bl,
+            self.sc_bl,
+            self.data_host,
+            self.restart_host,
+            self.sc_host,
+        ):
+            sock.close()
+
+
+def instance_args(root: Path, port: int) -> dict:
+    return {
+        "data_bl_sock": str(root / "data_bl.sock"),
+        "data_host_sock": port,
+        "restart_bl_sock": str(root / "restart_bl.sock"),
+        "restart_host_sock": str(root / "restart_host.sock"),
+        "sc_bl_sock": str(root / "sc_bl.sock"),
+        "sc_host_sock": str(root / "sc_host.sock"),
+    }
+
+
+class Interface:
+    """
+    A bl_interface.py process with clients on every channel of every instance
+
+    A single instance is configured on the command line so older versions of
+    the interface can be compared; more instances go through a manifest.
+    """
+    def __init__(self, interface: Path, root: Path, extra_args=(), instances=1):
+        roots = [root / f"device{i}" for i in range(instances)]
+        ports = [free_port() for _ in roots]
+        cmd = [sys.executable, "-u", str(interface)]
+        if instances == 1:
+            roots = [root]
+            for arg, value in instance_args(root, ports[0]).items():
+                cmd += [f"--{arg.replace('_', '-')}", str(value)]
+        else:
+            manifest = [instance_args(r, p) for r, p in zip(roots, ports)]
+            for r in roots:
+                r.mkdir()
+            (root / "manifest.json").write_text(json.dumps(manifest))
+            cmd += ["--manifest", str(root / "manifest.json")]
+        cmd += list(extra_args)
+
+        self.proc = subprocess.Popen(
+            cmd, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.clients = [Clients(r, p) for r, p in zip(roots, ports)]
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+        for clients in self.clients:
+            clients.close()
+
+
+def measure_idle(iface: Interface, seconds: float) -> float:
+    start = cpu_seconds(iface.proc.pid)
+    time.sleep(seconds)
+    return (cpu_seconds(iface.proc.pid) - start) / seconds
+
+
+def measure_throughput(src: socket.socket, dst: socket.socket, total: int) -> float:
+    chunk = bytes(CHUNK_SIZE)
+
+    def send():
+        sent = 0
+        while sent < total:
+            src.sendall(chunk)
+            sent += len(chunk)
+
+    sender = threading.Thread(target=send)
+    start = time.perf_counter()
+    sender.start()
+
+    received = 0
+    buf = bytearray(65536)
+    while received < total:
+        received += dst.recv_into(buf)
+    elapsed = time.perf_counter() - start
+    sender.join()
+
+    return total / elapsed
+
+
+def measure_latency(clients: Clients, pings: int) -> List[float]:
+    # round trip device -> host -> device through the data channel
+    rtts = []
+    for _ in range(pings):
+        start = time.perf_counter()
+        clients.data_bl.sendall(b"p")
+        clients.data_host.recv(1)
+        clients.data_host.sendall(b"p")
+        clients.data_bl.recv(1)
+        rtts.append(time.perf_counter() - start)
+    return rtts
+
+
+def measure_scaling(iface: Interface, total: int, pings: int):
+    # every instance streams its share at once, then pings at once
+    def stream(clients: Clients):
+        measure_throughput(clients.data_bl, clients.data_host, total)
+
+    threads = [threading.Thread(target=stream, args=(c,)) for c in iface.clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    aggregate = total * len(iface.clients) / (time.perf_counter() - start)
+
+    rtts = []
+
+    def ping(clients: Clients):
+        rtts.extend(measure_latency(clients, pings))
+
+    threads = [threading.Thread(target=ping, args=(c,)) for c in iface.clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rtts.sort()
+
+    return aggregate, rtts[len(rtts) // 2], rtts[int(len(rtts) * 0.99)]
+
+
+def run_scaling(
+    interface: Path, counts: List[int], megabytes: int, pings: int, extra_args=()
+):
+    log.info("Instances  Aggregate MB/s  RTT p50 (us)  RTT p99 (us)")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            iface = Interface(interface, Path(tmp), extra_args, instances=count)
+            try:
+                total = megabytes * 1024 * 1024 // count
+                aggregate, p50, p99 = measure_scaling(iface, total, pings)
+            finally:
+                iface.close()
+        log.info(
+            f"{count:>9}  {aggregate / 1e6:>14.1f}  {p50 * 1e6:>12.0f}"
+            f"  {p99 * 1e6:>12.0f}"
+        )
+
+
+def fetch_metrics(control_sock: Path) -> dict:
+    with connect_unix(control_sock) as sock:
+        report = b""
+        data = sock.recv(65536)
+        while data:
+            report += data
+            data = sock.recv(65536)
+    return json.loads(report)
+
+
+def run_metrics_overhead(interface: Path, megabytes: int, rounds: int, extra_args=()):
+    # alternate runs with and without detailed metrics to even out noise
+    total = megabytes * 1024 * 1024
+    results = {"--no-metrics": [], "metrics": []}
+    for _ in range(rounds):
+        for mode in results:
+            with tempfile.TemporaryDirectory() as tmp:
+                control_sock = Path(tmp, "control.sock")
+                args = [*extra_args, "--control-sock", str(control_sock)]
+                if mode == "--no-metrics":
+                    args.append(mode)
+                iface = Interface(interface, Path(tmp), args)
+                clients = iface.clients[0]
+                try:
+                    results[mode].append(
+                        measure_throughput(clients.data_bl, clients.data_host, total)
+                    )
+                    start = time.perf_counter()
+                    report = fetch_metrics(control_sock)
+                    query = time.perf_counter() - start
+                finally:
+                    iface.close()
+
+    base = max(results["--no-metrics"])
+    instrumented = max(results["metrics"])
+    latency = report["instances"]["device"]["data"]["host"]["latency_max_us"]
+    log.info(f"Without metrics:      {base / 1e6:.1f} MB/s")
+    log.info(f"With metrics:         {instrumented / 1e6:.1f} MB/s")
+    log.info(f"Overhead:             {(1 - instrumented / base) * 100:.1f}%")
+    log.info(f"Control socket query: {query * 1e3:.2f} ms")
+    log.info(f"Max relay latency:    {latency} us")
+
+
+def run(interface: Path, idle_seconds: float, megabytes: int, extra_args=()):
+    with tempfile.TemporaryDirectory() as tmp:
+        iface = Interface(interface, Path(tmp), extra_args)
+        clients = iface.clients[0]
+        try:
+            total = megabytes * 1024 * 1024
+            idle = measure_idle(iface, idle_seconds)
+            data_up = measure_throughput(clients.data_bl, clients.data_host, total)
+            data_down = measure_throughput(clients.data_host, clients.data_bl, total)
+            sc_up = measure_throughput(clients.sc_bl, clients.sc_host, total)
+        finally:
+            iface.close()
+
+    log.info(f"Interface:            {interface}")
+    log.info(f"Idle CPU:             {idle * 100:.1f}% of one core")
+    log.info(f"Data device -> host:  {data_up / 1e6:.1f} MB/s")
+    log.info(f"Data host -> device:  {data_down / 1e6:.1f} MB/s")
+    log.info(f"Side-channel:         {sc_up / 1e6:.1f} MB/s")
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # configure logging
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Measure idle CPU and relay throughput of bl_interface.py",
+    )
+    parser.add_argument(
+        "--interface",
+        type=Path,
+        default=BL_INTERFACE,
+        help="bl_interface.py to benchmark (default: the one in this repo)",
+    )
+    parser.add_argument(
+        "--idle-seconds",
+        type=float,
+        default=3,
+        help="How long to sample CPU use with all clients connected and idle",
+    )
+    parser.add_argument(
+        "--megabytes",
+        type=int,
+        default=64,
+        help="Amount of data to push through each channel direction",
+    )
+    parser.add_argument(
+        "--instances",
+        help="Comma-separated device counts to measure relay scaling with"
+        " (e.g. 1,4,16); the data volume is split across the devices",
+    )
+    parser.add_argument(
+        "--pings",
+        type=int,
+        default=200,
+        help="Round trips per device when measuring latency",
+    )
+    parser.add_argument(
+        "--metrics-overhead",
+        type=int,
+        metavar="ROUNDS",
+        help="Compare data-channel throughput with and without detailed metrics",
+    )
+    # any other arguments are passed on to the interface (e.g. --zero-copy)
+    args, interface_args = parser.parse_known_args()
+
+    if args.metrics_overhead:
+        run_metrics_overhead(
+            args.interface, args.megabytes, args.metrics_overhead, interface_args
+        )
+    elif args.instances:
+        counts = [int(count) for count in args.instances.split(",")]
+        run_scaling(
+            args.interface, counts, args.megabytes, args.pings, interface_args
+        )
+    else:
+        run(args.interface, args.idle_seconds, args.megabytes, interface_args)
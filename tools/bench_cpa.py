@@ -0,0 +1,86 @@
+# 2022 eCTF
+# Correlation Power Analysis Benchmark
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import os
+import time
+from typing import Tuple
+
+import numpy as np
+
+from cpa import CPA, HAMMING_WEIGHT, SBOX, report
+
+
+def synthetic_traces(
+    rng: np.random.Generator, key: bytes, count: int, samples: int, noise: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # byte i of the S-box output leaks its Hamming weight at sample 10 * i + 5,
+    # on top of gaussian noise around mid-scale
+    plaintexts = rng.integers(0, 256, (count, 16), dtype=np.uint8)
+    traces = rng.normal(128, noise, (count, samples))
+    leaks = HAMMING_WEIGHT[SBOX[plaintexts ^ np.frombuffer(key, dtype=np.uint8)]]
+    positions = (10 * np.arange(16) + 5) % samples
+    traces[:, positions] += 4 * leaks
+    return np.clip(traces, 0, 255).astype(np.uint8), plaintexts
+
+
+def check(cpa: CPA, traces: np.ndarray, plaintexts: np.ndarray):
+    # the running sums must give the same correlations as computing them
+    # over every trace at once
+    byte = 0
+    leaks = cpa.model[plaintexts[:, byte]]
+    expected = np.corrcoef(leaks.T, traces.T)[:256, 256:]
+    error = np.abs(np.nan_to_num(expected) - cpa.correlations(byte)).max()
+    print(f"Largest difference from np.corrcoef: {error:.2e}")
+
+
+def run(samples: int, traces: int, batch: int, noise: float):
+    rng = np.random.default_rng(0)
+    key = os.urandom(16)
+    cpa = CPA(samples)
+
+    # generate up front so only the analysis is timed
+    batches = [
+        synthetic_traces(rng, key, min(batch, traces - start), samples, noise)
+        for start in range(0, traces, batch)
+    ]
+
+    started = time.perf_counter()
+    for batch_traces, batch_texts in batches:
+        cpa.update(batch_traces, batch_texts)
+    seconds = time.perf_counter() - started
+    print(
+        f"update: {traces / seconds:.0f} traces/s"
+        f" ({samples} samples, {batch}-trace batches)"
+    )
+
+    started = time.perf_counter()
+    print(report(cpa, key))
+    print(f"report: {time.perf_counter() - started:.2f} s")
+
+    if len(batches) == 1 or traces * samples <= 50_000_000:
+        check(cpa, *map(np.concatenate, zip(*batches)))
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Measure CPA throughput on synthetic Hamming weight leakage",
+    )
+    parser.add_argument("--samples", type=int, default=2000, help="Samples per trace")
+    parser.add_argument("--traces", type=int, default=50000, help="Traces to analyse")
+    parser.add_argument("--batch", type=int, default=1024, help="Traces per update")
+    parser.add_argument(
+        "--noise", type=float, default=8.0, help="Standard deviation of the noise"
+    )
+    args = parser.parse_args()
+
+    run(args.samples, args.traces, args.batch, args.noise)
@@ -0,0 +1,238 @@
+# 2022 eCTF
+# Correlation Power Analysis
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import math
+import time
+from typing import Optional
+
+import numpy as np
+
+from trace_store import TraceStore
+
+
+SBOX = np.array(
+    [
+        0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5,
+        0x30, 0x01, 0x67, 0x2b, 0xfe, 0xd7, 0xab, 0x76,
+        0xca, 0x82, 0xc9, 0x7d, 0xfa, 0x59, 0x47, 0xf0,
+        0xad, 0xd4, 0xa2, 0xaf, 0x9c, 0xa4, 0x72, 0xc0,
+        0xb7, 0xfd, 0x93, 0x26, 0x36, 0x3f, 0xf7, 0xcc,
+        0x34, 0xa5, 0xe5, 0xf1, 0x71, 0xd8, 0x31, 0x15,
+        0x04, 0xc7, 0x23, 0xc3, 0x18, 0x96, 0x05, 0x9a,
+        0x07, 0x12, 0x80, 0xe2, 0xeb, 0x27, 0xb2, 0x75,
+        0x09, 0x83, 0x2c, 0x1a, 0x1b, 0x6e, 0x5a, 0xa0,
+        0x52, 0x3b, 0xd6, 0xb3, 0x29, 0xe3, 0x2f, 0x84,
+        0x53, 0xd1, 0x00, 0xed, 0x20, 0xfc, 0xb1, 0x5b,
+        0x6a, 0xcb, 0xbe, 0x39, 0x4a, 0x4c, 0x58, 0xcf,
+        0xd0, 0xef, 0xaa, 0xfb, 0x43, 0x4d, 0x33, 0x85,
+        0x45, 0xf9, 0x02, 0x7f, 0x50, 0x3c, 0x9f, 0xa8,
+        0x51, 0xa3, 0x40, 0x8f, 0x92, 0x9d, 0x38, 0xf5,
+        0xbc, 0xb6, 0xda, 0x21, 0x10, 0xff, 0xf3, 0xd2,
+        0xcd, 0x0c, 0x13, 0xec, 0x5f, 0x97, 0x44, 0x17,
+        0xc4, 0xa7, 0x7e, 0x3d, 0x64, 0x5d, 0x19, 0x73,
+        0x60, 0x81, 0x4f, 0xdc, 0x22, 0x2a, 0x90, 0x88,
+        0x46, 0xee, 0xb8, 0x14, 0xde, 0x5e, 0x0b, 0xdb,
+        0xe0, 0x32, 0x3a, 0x0a, 0x49, 0x06, 0x24, 0x5c,
+        0xc2, 0xd3, 0xac, 0x62, 0x91, 0x95, 0xe4, 0x79,
+        0xe7, 0xc8, 0x37, 0x6d, 0x8d, 0xd5, 0x4e, 0xa9,
+        0x6c, 0x56, 0xf4, 0xea, 0x65, 0x7a, 0xae, 0x08,
+        0xba, 0x78, 0x25, 0x2e, 0x1c, 0xa6, 0xb4, 0xc6,
+        0xe8, 0xdd, 0x74, 0x1f, 0x4b, 0xbd, 0x8b, 0x8a,
+        0x70, 0x3e, 0xb5, 0x66, 0x48, 0x03, 0xf6, 0x0e,
+        0x61, 0x35, 0x57, 0xb9, 0x86, 0xc1, 0x1d, 0x9e,
+        0xe1, 0xf8, 0x98, 0x11, 0x69, 0xd9, 0x8e, 0x94,
+        0x9b, 0x1e, 0x87, 0xe9, 0xce, 0x55, 0x28, 0xdf,
+        0x8c, 0xa1, 0x89, 0x0d, 0xbf, 0xe6, 0x42, 0x68,
+        0x41, 0x99, 0x2d, 0x0f, 0xb0, 0x54, 0xbb, 0x16,
+    ],
+    dtype=np.uint8,
+)
+
+HAMMING_WEIGHT = np.array([bin(value).count("1") for value in range(256)])
+
+
+def hw_sbox_model() -> np.ndarray:
+    # predicted leakage for (plaintext byte, key guess): HW(SBOX[p ^ k])
+    values = np.arange(256)
+    return HAMMING_WEIGHT[SBOX[values[:, None] ^ values]].astype(np.float64)
+
+
+class CPA:
+    """
+    Incremental correlation power analysis on the first-round AES S-box
+
+    update() folds a batch of traces into running sums: for each key byte, the
+    number of traces and the sum of the traces seen with each plaintext byte
+    value, and the sum and sum of squares of every sample. These give the
+    correlation of every key guess with every sample under any leakage model
+    of (plaintext byte, key guess), so memory is fixed however many traces are
+    added and results can be read between batches.
+    """
+    def __init__(
+        self, samples: int, key_bytes: int = 16, model: Optional[np.ndarray] = None
+    ):
+        self.samples = samples
+        self.key_bytes = key_bytes
+        self.model = hw_sbox_model() if model is None else model
+        self.traces = 0
+        self.counts = np.zeros((key_bytes, 256), dtype=np.int64)
+        self.value_sums = np.zeros((key_bytes, 256, samples))
+        self.sample_sums = np.zeros(samples)
+        self.sample_squares = np.zeros(samples)
+
+    def update(self, traces: np.ndarray, plaintexts: np.ndarray):
+        traces = np.asarray(traces).reshape(-1, self.samples)
+        plaintexts = np.asarray(plaintexts, dtype=np.uint8).reshape(len(traces), -1)
+        if not len(traces):
+            return
+
+        # byte samples are summed in uint32 (exact below 16M traces a batch),
+        # which is about twice as fast as summing in float64
+        sum_dtype = np.float64
+        if traces.dtype == np.uint8:
+            sum_dtype = np.uint32
+        wide = traces.astype(np.float64)
+        self.sample_sums += wide.sum(axis=0)
+        self.sample_squares += np.einsum("ij,ij->j", wide, wide)
+
+        for byte in range(self.key_bytes):
+            # sort the batch by this plaintext byte and sum each run of equal
+            # values, rather than projecting every trace onto 256 guesses
+            column = plaintexts[:, byte]
+            order = np.argsort(column)
+            counts = np.bincount(column, minlength=256)
+            values = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts[values])[:-1]))
+            self.value_sums[byte, values] += np.add.reduceat(
+                traces[order], starts, axis=0, dtype=sum_dtype
+            )
+            self.counts[byte] += counts
+        self.traces += len(traces)
+
+    def correlations(self, byte: int) -> np.ndarray:
+        # (key guess, sample) Pearson correlation for one key byte
+        n = max(self.traces, 1)
+        counts, model = self.counts[byte], self.model
+        guess_means = counts @ model / n
+        guess_vars = counts @ (model * model) / n - guess_means**2
+        sample_means = self.sample_sums / n
+        sample_vars = self.sample_squares / n - sample_means**2
+        cov = model.T @ self.value_sums[byte] / n - np.outer(guess_means, sample_means)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.sqrt(np.outer(guess_vars, sample_vars))
+        return np.nan_to_num(corr)
+
+    def peaks(self) -> np.ndarray:
+        # (key byte, key guess) highest absolute correlation over all samples
+        return np.array(
+            [
+                np.abs(self.correlations(byte)).max(axis=1)
+                for byte in range(self.key_bytes)
+            ]
+        )
+
+    def guess(self, peaks: Optional[np.ndarray] = None) -> bytes:
+        peaks = self.peaks() if peaks is None else peaks
+        return bytes(peaks.argmax(axis=1).astype(np.uint8))
+
+    def ranks(self, key: bytes, peaks: Optional[np.ndarray] = None) -> np.ndarray:
+        # guesses that beat the right key byte, for each byte (0 is recovered)
+        peaks = self.peaks() if peaks is None else peaks
+        right = peaks[np.arange(self.key_bytes), np.frombuffer(key, dtype=np.uint8)]
+        return (peaks > right[:, None]).sum(axis=1)
+
+
+def report(cpa: CPA, key: Optional[bytes] = None) -> str:
+    peaks = cpa.peaks()
+    line = f"{cpa.traces} traces: best guess {cpa.guess(peaks).hex()}"
+    if key is not None:
+        ranks = cpa.ranks(key, peaks)
+        # trying guesses in byte-rank order finds the key within this many
+        bound = sum(math.log2(rank + 1) for rank in ranks)
+        line += (
+            f", {(ranks == 0).sum()}/{len(ranks)} bytes recovered,"
+            f" key rank <= 2^{bound:.1f}"
+        )
+    return line
+
+
+def attack_store(
+    store: TraceStore,
+    key: Optional[bytes] = None,
+    follow: bool = False,
+    poll_interval: float = 1.0,
+    report_traces: int = 10000,
+) -> CPA:
+    # feed every chunk through the engine; when following, keep picking up the
+    # chunks a running campaign appends until interrupted
+    cpa = CPA(store.samples)
+    number = 0
+    reported = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            while number < len(store.starts):
+                chunk = store.load_chunk(number, ("traces", "plaintext"))
+                cpa.update(chunk["traces"], chunk["plaintext"])
+                number += 1
+                if cpa.traces - reported >= report_traces:
+                    rate = cpa.traces / (time.perf_counter() - started)
+                    print(f"{report(cpa, key)} ({rate:.0f} traces/s)")
+                    reported = cpa.traces
+            if not follow:
+                break
+            time.sleep(poll_interval)
+            store.reload()
+    except KeyboardInterrupt:
+        pass
+
+    print(report(cpa, key))
+    return cpa
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Recover an AES key from a trace store by correlation power"
+        " analysis on the first-round S-box output",
+    )
+    parser.add_argument(
+        "store", help="Trace store directory with plaintexts (see trace_store.py)"
+    )
+    parser.add_argument(
+        "--key", help="Known key as hex, to report how far each byte is from found"
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Keep analysing traces as a running campaign adds them (Ctrl-C stops)",
+    )
+    parser.add_argument(
+        "--report-traces",
+        type=int,
+        default=10000,
+        help="Report the best guess every this many traces",
+    )
+    args = parser.parse_args()
+
+    store = TraceStore(args.store)
+    if "plaintext" not in store.index.get("arrays", ["plaintext"]):
+        parser.error(f"{args.store} has no plaintexts")
+    key = None
+    if args.key:
+        try:
+            key = bytes.fromhex(args.key)
+        except ValueError:
+            key = b""
+        if len(key) != 16:
+            parser.error("--key must be 32 hex digits")
+    attack_store(store, key, args.follow, report_traces=args.report_traces)
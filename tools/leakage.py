@@ -0,0 +1,209 @@
+# 2022 eCTF
+# Online Leakage Assessment
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+from typing import Optional
+
+import numpy as np
+
+from cpa import HAMMING_WEIGHT, SBOX
+from trace_store import TraceStore
+
+
+# fixed plaintext of the fixed-vs-random test in the TVLA methodology
+TVLA_FIXED = bytes.fromhex("da39a3ee5e6b4b0d3255bfef95601890")
+
+# |t| beyond which a sample leaks, at about 99.999% confidence
+T_THRESHOLD = 4.5
+
+# traces each group needs before a campaign may stop on its result; with
+# fewer, |t| has heavy tails and some of thousands of samples will pass 4.5,
+# and the SNR of a sample rests on a handful of traces per group
+MIN_T_GROUP = 500
+MIN_SNR_GROUP = 10
+
+
+class GroupStats:
+    """
+    Running count, mean and variance of every sample, per group of traces
+
+    Each batch is split by group, its per-group means and sums of squared
+    deviations are computed around the batch's own means, and merged into the
+    running ones with Welford's update (in Chan's form for batches), so the
+    variance stays accurate over millions of traces.
+    """
+    def __init__(self, groups: int, samples: int):
+        self.count = np.zeros(groups, dtype=np.int64)
+        self.mean = np.zeros((groups, samples))
+        self.m2 = np.zeros((groups, samples))
+
+    def update(self, traces: np.ndarray, labels: np.ndarray):
+        order = np.argsort(labels)
+        traces = np.asarray(traces, dtype=np.float64)[order]
+        labels = labels[order]
+        counts = np.bincount(labels, minlength=len(self.count))
+        groups = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[groups])[:-1]))
+
+        # batch statistics of each group present
+        batch_count = counts[groups]
+        batch_mean = np.add.reduceat(traces, starts, axis=0) / batch_count[:, None]
+        deviations = traces - np.repeat(batch_mean, batch_count, axis=0)
+        batch_m2 = np.add.reduceat(deviations * deviations, starts, axis=0)
+
+        # merge them into the running statistics
+        count = self.count[groups]
+        total = count + batch_count
+        delta = batch_mean - self.mean[groups]
+        self.mean[groups] += delta * (batch_count / total)[:, None]
+        self.m2[groups] += batch_m2 + delta**2 * (count * batch_count / total)[:, None]
+        self.count[groups] = total
+
+    def variance(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.m2 / (self.count[:, None] - 1)
+
+
+class LeakageAssessment:
+    """
+    Welch's t-test (fixed vs random plaintexts) and SNR over a campaign
+
+    Traces whose plaintext is `fixed` form one t-test group and all others
+    the second. Leaving `fixed` unset skips the t-test. As TVLA asks, traces
+    also alternate between two halves tested separately, and a sample only
+    counts as leaking when it passes in both with the same sign, which keeps
+    checking after every batch from passing on noise alone. The SNR groups traces
+    by plaintext byte `snr_byte`, or by the Hamming weight of its first-round
+    S-box output when the key is known. The SNR of a sample is the variance of
+    the group means over the mean variance within groups, less the part of the
+    former that is only noise in the means.
+    """
+    def __init__(
+        self,
+        samples: int,
+        fixed: Optional[bytes] = None,
+        snr_byte: int = 0,
+        key: Optional[bytes] = None,
+    ):
+        self.samples = samples
+        self.fixed = None if fixed is None else np.frombuffer(fixed, dtype=np.uint8)
+        self.snr_byte = snr_byte
+        self.key_byte = None if key is None else key[snr_byte]
+        self.traces = 0
+        self.ttest = GroupStats(2, samples)
+        self.halves = GroupStats(4, samples)
+        self.snr_groups = GroupStats(256 if key is None else 9, samples)
+
+    def update(self, traces, plaintexts):
+        # traces and plaintexts can be arrays or raw bytes of whole rows
+        traces = np.asarray(traces).reshape(-1, self.samples)
+        plaintexts = np.asarray(plaintexts, dtype=np.uint8).reshape(len(traces), 16)
+        if not len(traces):
+            return
+
+        if self.fixed is not None:
+            random = (plaintexts != self.fixed).any(axis=1).astype(np.intp)
+            half = (self.traces + np.arange(len(traces))) % 2
+            self.ttest.update(traces, random)
+            self.halves.update(traces, 2 * half + random)
+
+        labels = plaintexts[:, self.snr_byte]
+        if self.key_byte is not None:
+            labels = HAMMING_WEIGHT[SBOX[labels ^ self.key_byte]]
+        self.snr_groups.update(traces, labels.astype(np.intp))
+        self.traces += len(traces)
+
+    def t_values(self, half: Optional[int] = None) -> np.ndarray:
+        # Welch's t for every sample, over all traces or one half of them;
+        # 0 until both groups have two traces
+        stats, groups = self.ttest, slice(0, 2)
+        if half is not None:
+            stats, groups = self.halves, slice(2 * half, 2 * half + 2)
+        count = stats.count[groups]
+        if self.fixed is None or (count < 2).any():
+            return np.zeros(self.samples)
+        mean = stats.mean[groups]
+        error = np.sqrt((stats.variance()[groups] / count[:, None]).sum(axis=0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (mean[0] - mean[1]) / error
+        return np.nan_to_num(t, posinf=0, neginf=0)
+
+    def leaking(self, threshold: float = T_THRESHOLD) -> np.ndarray:
+        # samples past the threshold, with the same sign, in both halves
+        first, second = self.t_values(0), self.t_values(1)
+        same_sign = np.sign(first) == np.sign(second)
+        passed = np.minimum(np.abs(first), np.abs(second)) >= threshold
+        return np.flatnonzero(same_sign & passed)
+
+    def snr(self) -> np.ndarray:
+        # groups with fewer than two traces have no variance to count
+        present = self.snr_groups.count > 1
+        if present.sum() < 2:
+            return np.zeros(self.samples)
+        variance = self.snr_groups.variance()[present]
+        signal = self.snr_groups.mean[present].var(axis=0)
+        signal -= (variance / self.snr_groups.count[present, None]).mean(axis=0)
+        noise = variance.mean(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(np.maximum(signal, 0) / noise, posinf=0)
+
+    def summary(self) -> str:
+        snr = self.snr()
+        line = f"max SNR {snr.max():.3f} at sample {snr.argmax()}"
+        if self.fixed is not None:
+            t = np.abs(self.t_values())
+            leaking = len(self.leaking())
+            line = (
+                f"max |t| {t.max():.1f} at sample {t.argmax()}"
+                f" ({leaking} samples leak in both halves), {line}"
+            )
+        return line
+
+    def reached(
+        self, t_threshold: Optional[float] = None, snr_threshold: Optional[float] = None
+    ) -> bool:
+        # whether either target has been met, so collection can stop
+        if t_threshold is not None and self.halves.count.min() >= MIN_T_GROUP:
+            if len(self.leaking(t_threshold)):
+                return True
+        counts = self.snr_groups.count[self.snr_groups.count > 0]
+        if snr_threshold is not None and counts.size and counts.min() >= MIN_SNR_GROUP:
+            return self.snr().max() >= snr_threshold
+        return False
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Run a TVLA t-test and SNR over the traces in a trace store",
+    )
+    parser.add_argument("store", help="Trace store directory with plaintexts")
+    parser.add_argument(
+        "--fixed",
+        default=TVLA_FIXED.hex(),
+        help="Fixed plaintext of the t-test as hex (default: the TVLA one)",
+    )
+    parser.add_argument(
+        "--snr-byte", type=int, default=0, help="Plaintext byte to group SNR by"
+    )
+    parser.add_argument(
+        "--key", help="Known key as hex, to group SNR by S-box output weight"
+    )
+    args = parser.parse_args()
+
+    store = TraceStore(args.store)
+    key = bytes.fromhex(args.key) if args.key else None
+    assessment = LeakageAssessment(
+        store.samples, bytes.fromhex(args.fixed), args.snr_byte, key
+    )
+    for _, chunk in store.chunks(("traces", "plaintext")):
+        assessment.update(chunk["traces"], chunk["plaintext"])
+    print(f"{assessment.traces} traces: {assessment.summary()}")
@@ -0,0 +1,160 @@
+# 2022 eCTF
+# Physical Device Fleet Loader
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from serial.serialutil import SerialException
+
+import load_image
+from serial_discovery import PortWatcher
+
+
+log = logging.getLogger(__name__)
+
+
+class BoardResult:
+    """
+    Progress and outcome of loading one board
+    """
+    def __init__(self, port: str):
+        self.port = port
+        self.blocks = 0
+        self.seconds = 0.0
+        self.ok = False
+        self.error = ""
+
+    def progress(self, blocks: int):
+        self.blocks = blocks
+
+
+def load_board(port: str, fw_data: memoryview, window: int) -> BoardResult:
+    # log lines carry the thread name, so name it after the board
+    threading.current_thread().name = Path(port).name
+    result = BoardResult(port)
+    start = time.perf_counter()
+    ser = load_image.open_port(port)
+    try:
+        code = load_image.install(ser, fw_data, window, result.progress)
+        if code == load_image.WINDOW_FAILED:
+            ser.close()
+            code = load_image.retry_install(port, fw_data, result.progress)
+        result.ok = code == 0
+    except (SerialException, OSError) as e:
+        log.error(f"Lost {port}: {e}")
+        result.error = str(e)
+    finally:
+        ser.close()
+        result.seconds = time.perf_counter() - start
+    return result
+
+
+def log_summary(results: List[BoardResult]):
+    log.info(f"{'Port':<24} {'Result':<7} {'Blocks':>11} {'Seconds':>8}")
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        blocks = f"{result.blocks}/{load_image.TOTAL_BLOCKS}"
+        log.info(f"{result.port:<24} {status:<7} {blocks:>11} {result.seconds:>8.1f}")
+    failed = sum(not result.ok for result in results)
+    log.info(f"{len(results) - failed} of {len(results)} boards loaded")
+
+
+def load_fleet(
+    in_file,
+    ports: Optional[List[str]] = None,
+    count: int = 0,
+    window: int = load_image.DEFAULT_WINDOW,
+    timeout: Optional[float] = None,
+) -> List[BoardResult]:
+    # map the image once; every board streams from the same pages
+    fw_data = load_image.read_image(in_file)
+    if fw_data is None:
+        return []
+
+    futures: List[Future] = []
+    with ThreadPoolExecutor(max_workers=max(len(ports or []), count, 1)) as pool:
+        if ports:
+            for port in ports:
+                futures.append(pool.submit(load_board, port, fw_data, window))
+        else:
+            # start on each board as soon as it shows up
+            log.info(f"Waiting for {count} boards. Connect and turn on the devices.")
+            deadline = None if timeout is None else time.monotonic() + timeout
+            seen: List[str] = []
+            with PortWatcher() as watcher:
+                while len(seen) < count:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = max(deadline - time.monotonic(), 0)
+                    new_ports = watcher.wait_for(len(seen) + 1, remaining)
+                    for port in new_ports:
+                        if port not in seen:
+                            log.info(f"Found {port}")
+                            seen.append(port)
+                            future = pool.submit(load_board, port, fw_data, window)
+                            futures.append(future)
+                    timed_out = deadline is not None and time.monotonic() >= deadline
+                    if len(seen) < count and timed_out:
+                        log.error(f"Only {len(seen)} of {count} boards appeared")
+                        break
+
+    results = [future.result() for future in futures]
+    log_summary(results)
+    return results
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # configure logging
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)-8s %(threadName)-12s %(message)s"
+    )
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Load one image into many physical devices at once",
+    )
+    parser.add_argument("--infile", required=True, help="Path to the input binary")
+    ports = parser.add_mutually_exclusive_group(required=True)
+    ports.add_argument(
+        "--serial-port",
+        action="append",
+        help="Serial port of a device to load (repeat for each device)",
+    )
+    ports.add_argument(
+        "--boards",
+        type=int,
+        help="Number of devices to wait for, loading each as it is connected",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=load_image.DEFAULT_WINDOW,
+        help="Blocks to keep in flight per device (1 for stop-and-wait); a board"
+        " whose windowed transfer fails is retried in stop-and-wait once it is"
+        " power-cycled",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Seconds to wait for --boards devices to be connected",
+    )
+    args = parser.parse_args()
+
+    results = load_fleet(
+        args.infile, args.serial_port, args.boards or 0, args.window, args.timeout
+    )
+    if not results or not all(result.ok for result in results):
+        exit(1)
@@ -15,10 +15,13 @@ import argparse
 import logging
 from enum import Enum
 from pathlib import Path
+from typing import Callable, Optional
 from serial import Serial
-from serial.tools import list_ports
 from serial.serialutil import SerialException
 
+from serial_discovery import PortWatcher, wait_for_ports
+from update_protocol import BlockStream, read_image as map_image, response_table
+
 
 log = logging.getLogger(__name__)
 
@@ -35,6 +38,15 @@ TOTAL_SIZE = APP_SIZE + EEPROM_SIZE
 TOTAL_PAGES = APP_PAGES + EEPROM_PAGES
 TOTAL_BLOCKS = APP_BLOCKS + EEPROM_BLOCKS
 
+# blocks kept in flight by default. --window 2 lets the next block wait in
+# the bootstrapper's 16-byte UART receive FIFO while it installs one; a third
+# would overrun it.
+DEFAULT_WINDOW = 1
+
+# install() result of a windowed transfer that failed part way; the device
+# only accepts another update once it has been power-cycled
+WINDOW_FAILED = -2
+
 
 class Code(Enum):
     RequestUpdate = b"\x00"
@@ -50,17 +62,14 @@ class Code(Enum):
     AppInstallError = b"\x0a"
 
 
-def get_serial_port():
-    orig_ports = set(list_ports.comports())
-    while True:
-        ports = set(list_ports.comports())
-        new_ports = ports - orig_ports
+# anything but the install OK for the block's region is a failure
+APP_BLOCK_RESPONSES = response_table(Code.AppBlockInstallOK.value)
+EEPROM_BLOCK_RESPONSES = response_table(Code.EEPROMBlockInstallOK.value)
 
-        if len(new_ports) == 1:
-            new_port = new_ports.pop()
-            return new_port.device
 
-        orig_ports = ports
+def get_serial_port():
+    # sleeps until a new port shows up instead of rescanning continuously
+    return wait_for_ports()[0]
 
 
 def verify_resp(ser: Serial, expected: Code):
@@ -71,45 +80,16 @@ def verify_resp(ser: Serial, expected: Code):
     assert Code(resp) == expected
 
 
-def load(in_file):
-    # USAGE:
-    #   1. Start this script
-    #   2. Start the device
-    #
-    # This script finds the correct serial port by looking at an initial
-    # list and waiting for a new entry to show up.
-    # It then assumes that is the correct port and tries an update
-
-    # Look for a serial port to open
-    log.info("Searching for serial port. Connect and Turn on device.")
-    com_port = get_serial_port()
-
-    # Keep trying to connect
-    log.info(f"Connecting to serial port {com_port}...")
-    while True:
-        try:
-            ser = Serial(com_port, 115200, timeout=2)
-            ser.reset_input_buffer()
-            break
-        except SerialException:
-            # Try until serial is ready to accept
-            pass
-
-    # Open firmware
-    log.info("Reading image file...")
-    fw_file = Path(in_file)
-    if not fw_file.exists():
-        log.error(f"Firmware file {fw_file} not found.")
-        ser.close()
-        return
+def describe_resp(resp: bytes) -> str:
+    if resp == b"":
+        return "no response"
+    try:
+        return Code(resp).name
+    except ValueError:
+        return f"unknown response 0x{resp.hex()}"
 
-    fw_data = fw_file.read_bytes()
-    fw_size = len(fw_data)
-    if fw_size != TOTAL_SIZE:
-        log.error(f"Invalid image size 0x{fw_size:X}. Expected 0x{TOTAL_SIZE:X}.")
-        ser.close()
-        return
 
+def start_update(ser: Serial) -> bool:
     # Wait for bootloader ready
     log.info("Requesting update...")
     ser.write(Code.RequestUpdate.value)
@@ -117,8 +97,7 @@ def load(in_file):
         verify_resp(ser, Code.StartUpdate)
     except AssertionError:
         log.error("Bootloader did not start an update")
-        ser.close()
-        return
+        return False
 
     # Wait for Flash erase
     log.info("Waiting for Flash Erase...")
@@ -126,8 +105,7 @@ def load(in_file):
         verify_resp(ser, Code.UpdateInitFlashEraseOK)
     except AssertionError:
         log.error("Error while erasing Flash")
-        ser.close()
-        return
+        return False
 
     # Wait for EEPROM erase
     log.info("Waiting for EEPROM Erase...")
@@ -135,33 +113,87 @@ def load(in_file):
         verify_resp(ser, Code.UpdateInitEEPROMEraseOK)
     except AssertionError:
         log.error("Error while erasing EEPROM")
-        ser.close()
-        return
+        return False
+
+    return True
+
+
+def block_responses(block: int) -> bytes:
+    if block < APP_BLOCKS:
+        return APP_BLOCK_RESPONSES
+    return EEPROM_BLOCK_RESPONSES
+
+
+def send_blocks(
+    ser: Serial,
+    fw_data: memoryview,
+    window: int = 1,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Optional[int]:
+    # Keep up to `window` blocks in flight. Returns the index of the block that
+    # failed, if any; progress is called with the number of blocks installed.
+    def installed(blocks: int, total: int):
+        if (blocks % 100) == 0:
+            log.info(f"Installed block {blocks} of {total}...")
+        if progress:
+            progress(blocks)
+
+    stream = BlockStream(ser, fw_data, BLOCK_SIZE, window, installed)
+    failed = stream.send(block_responses)
+    if failed is not None:
+        log.error(
+            f"Install failed at block {failed+1} of {TOTAL_BLOCKS}"
+            f" (image offset 0x{failed * BLOCK_SIZE:X}): {describe_resp(stream.resp)}"
+            f" with {stream.sent - failed} block(s) in flight"
+        )
+    return failed
+
+
+def open_port(com_port: str) -> Serial:
+    # Keep trying to connect
+    log.info(f"Connecting to serial port {com_port}...")
+    while True:
+        try:
+            ser = Serial(com_port, 115200, timeout=2)
+            ser.reset_input_buffer()
+            return ser
+        except SerialException:
+            # Try until serial is ready to accept
+            pass
 
-    # Send data in 16-byte blocks
-    log.info("Sending firmware...")
-    total_bytes = len(fw_data)
-    block_count = 0
-    i = 0
-    while i < total_bytes:
-        if ((block_count + 1) % 100) == 0:
-            log.info(f"Sending block {block_count+1} of {TOTAL_BLOCKS}...")
-        block_bytes = fw_data[i : i + BLOCK_SIZE]
 
-        ser.write(block_bytes)
+def read_image(in_file) -> Optional[memoryview]:
+    fw_file = Path(in_file)
+    if not fw_file.exists():
+        log.error(f"Firmware file {fw_file} not found.")
+        return None
+
+    fw_data = map_image(fw_file)
+    fw_size = len(fw_data)
+    if fw_size != TOTAL_SIZE:
+        log.error(f"Invalid image size 0x{fw_size:X}. Expected 0x{TOTAL_SIZE:X}.")
+        return None
+    return fw_data
+
 
-        try:
-            if block_count < APP_BLOCKS:
-                verify_resp(ser, Code.AppBlockInstallOK)
-            else:
-                verify_resp(ser, Code.EEPROMBlockInstallOK)
-
-            i += BLOCK_SIZE
-            block_count += 1
-        except AssertionError:
-            log.error(f"Install failed at block {block_count+1}.")
-            ser.close()
-            return -1
+def install(
+    ser: Serial,
+    fw_data: memoryview,
+    window: int = DEFAULT_WINDOW,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    if not start_update(ser):
+        return -1
+
+    # Send data in 16-byte blocks
+    log.info(f"Sending firmware with {window} block(s) in flight...")
+    failed = send_blocks(ser, fw_data, window, progress)
+
+    # The bootstrapper only accepts RequestUpdate at power-up, and after an
+    # overrun it is out of step with the blocks, so neither restarting nor
+    # resuming can recover a failed transfer here
+    if failed is not None:
+        return WINDOW_FAILED if window > 1 else -1
 
     try:
         verify_resp(ser, Code.AppInstallOK)
@@ -174,6 +206,60 @@ def load(in_file):
     return 0
 
 
+def wait_for_power_cycle(port: Optional[str] = None) -> str:
+    # the port the device comes back on (`port`, if given) once power-cycled
+    log.warning("Power-cycle the device to retry in stop-and-wait mode...")
+    with PortWatcher() as watcher:
+        new_ports = watcher.wait_for()
+        while port is not None and port not in new_ports:
+            new_ports = watcher.wait_for(len(new_ports) + 1)
+    return port or new_ports[0]
+
+
+def retry_install(
+    port: Optional[str],
+    fw_data: memoryview,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    # after a failed windowed transfer, load the power-cycled device again
+    # one block at a time
+    ser = open_port(wait_for_power_cycle(port))
+    try:
+        return install(ser, fw_data, 1, progress)
+    finally:
+        ser.close()
+
+
+def load(in_file, window: int = DEFAULT_WINDOW):
+    # USAGE:
+    #   1. Start this script
+    #   2. Start the device
+    #
+    # This script finds the correct serial port by looking at an initial
+    # list and waiting for a new entry to show up.
+    # It then assumes that is the correct port and tries an update
+
+    # Look for a serial port to open
+    log.info("Searching for serial port. Connect and Turn on device.")
+    com_port = get_serial_port()
+    ser = open_port(com_port)
+
+    # Open firmware
+    log.info("Reading image file...")
+    fw_data = read_image(in_file)
+    if fw_data is None:
+        ser.close()
+        return
+
+    try:
+        result = install(ser, fw_data, window)
+    finally:
+        ser.close()
+    if result == WINDOW_FAILED:
+        result = retry_install(None, fw_data)
+    return result
+
+
 # Run in application mode
 if __name__ == "__main__":
     # configure logging
@@ -182,7 +268,15 @@ if __name__ == "__main__":
     # Parse arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--infile", required=True, help="Path to the input binary")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=DEFAULT_WINDOW,
+        help="Blocks to keep in flight (1 for stop-and-wait). A failed windowed"
+        " transfer cannot be resumed, so it is retried in stop-and-wait once"
+        f" the device is power-cycled (default: {DEFAULT_WINDOW})",
+    )
     args = parser.parse_args()
 
     # load the image
-    load(args.infile)
+    load(args.infile, args.window)
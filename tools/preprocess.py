@@ -0,0 +1,206 @@
+# 2022 eCTF
+# Side-Channel Trace Preprocessing
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from trace_store import TraceStore
+
+
+def fft_size(length: int) -> int:
+    # next power of two, which numpy's FFT handles fastest
+    return 1 << max(length - 1, 0).bit_length()
+
+
+class Preprocessor:
+    """
+    Band-pass filters, aligns and decimates whole batches of traces
+
+    Filtering masks the traces' spectrum. Alignment slides each trace against
+    a window of the reference trace by up to `max_shift` samples, picking the
+    shift with the highest normalized cross-correlation. The correlations for
+    every shift of every trace in the batch come from one FFT. Decimation
+    averages each run of `decimate` samples.
+    """
+    def __init__(
+        self,
+        reference: np.ndarray,
+        window: Optional[Tuple[int, int]] = None,
+        max_shift: int = 0,
+        band: Optional[Tuple[float, float]] = None,
+        decimate: int = 1,
+    ):
+        self.samples = len(reference)
+        self.band = band
+        self.decimate = decimate
+
+        # the reference goes through the same filter as the traces
+        reference = self.filter(np.asarray(reference, dtype=np.float64)[None])[0]
+        # by default, all of the reference that stays in view at every shift
+        start, stop = window or (max_shift, self.samples - max_shift)
+        if not 0 <= start < stop <= self.samples:
+            raise ValueError(f"Window {start}:{stop} is outside the traces")
+
+        # shifts that keep the window inside the trace
+        self.low = max(-max_shift, -start)
+        self.high = min(max_shift, self.samples - stop)
+        self.start = start
+        self.width = stop - start
+        self.span = self.width + self.high - self.low
+        self.nfft = fft_size(self.span)
+        template = reference[start:stop] - reference[start:stop].mean()
+        self.template_norm = np.sqrt((template * template).sum())
+        self.template_fft = np.conj(np.fft.rfft(template, self.nfft))
+
+    def filter(self, traces: np.ndarray) -> np.ndarray:
+        if self.band is None:
+            return traces
+        # zero padded to twice the length so the filter does not wrap around
+        nfft = fft_size(2 * traces.shape[1])
+        spectrum = np.fft.rfft(traces, nfft, axis=1)
+        frequencies = np.fft.rfftfreq(nfft)
+        low, high = self.band
+        spectrum[:, (frequencies < low) | (frequencies > high)] = 0
+        return np.fft.irfft(spectrum, nfft, axis=1)[:, : traces.shape[1]]
+
+    def shifts(self, traces: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # (best shift, its normalized correlation) for each trace
+        begin = self.start + self.low
+        segments = traces[:, begin : begin + self.span]
+        lags = self.high - self.low + 1
+        spectrum = np.fft.rfft(segments, self.nfft, axis=1) * self.template_fft
+        products = np.fft.irfft(spectrum, self.nfft, axis=1)[:, :lags]
+
+        # sum and sum of squares of the segment under the window at each lag
+        zero = np.zeros((len(traces), 1))
+        sums = np.concatenate((zero, segments.cumsum(axis=1)), axis=1)
+        squares = np.concatenate((zero, (segments * segments).cumsum(axis=1)), axis=1)
+        window_sums = sums[:, self.width :] - sums[:, :lags]
+        window_squares = squares[:, self.width :] - squares[:, :lags]
+        variance = np.maximum(window_squares - window_sums**2 / self.width, 1e-12)
+        scores = products / (np.sqrt(variance) * self.template_norm)
+
+        best = scores.argmax(axis=1)
+        return best + self.low, scores[np.arange(len(traces)), best]
+
+    def align(self, traces: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+        # move each trace back by its shift; the edges repeat the end samples
+        positions = np.arange(self.samples) + shifts[:, None]
+        np.clip(positions, 0, self.samples - 1, out=positions)
+        return np.take_along_axis(traces, positions, axis=1)
+
+    def process(self, traces: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (processed traces, shifts, correlation scores)
+        traces = self.filter(np.asarray(traces, dtype=np.float64))
+        shifts = np.zeros(len(traces), dtype=np.int64)
+        scores = np.ones(len(traces))
+        if self.high > self.low:
+            shifts, scores = self.shifts(traces)
+            traces = self.align(traces, shifts)
+        if self.decimate > 1:
+            kept = traces.shape[1] // self.decimate * self.decimate
+            traces = traces[:, :kept].reshape(len(traces), -1, self.decimate)
+            traces = traces.mean(axis=2)
+        return traces.astype(np.float32), shifts, scores
+
+
+def preprocess_store(
+    source: TraceStore,
+    target: TraceStore,
+    preprocessor: Preprocessor,
+    min_score: float = -1.0,
+) -> Tuple[int, int]:
+    # process the source chunk by chunk, appending to the target with the
+    # same columns. Traces that match the reference worse than min_score
+    # are dropped. Returns (traces read, traces kept).
+    names = source.index.get("arrays", ["traces"])
+    read = kept = 0
+    started = time.perf_counter()
+    for _, chunk in source.chunks(names):
+        traces, shifts, scores = preprocessor.process(chunk.pop("traces"))
+        keep = scores >= min_score
+        columns = {name: rows[keep] for name, rows in chunk.items()}
+        target.append(traces[keep], **columns)
+        read += len(keep)
+        kept += int(keep.sum())
+
+        rate = read / (time.perf_counter() - started)
+        print(
+            f"{read} traces ({rate:.0f} traces/s):"
+            f" shifts {shifts.min()}..{shifts.max()},"
+            f" median score {np.median(scores):.2f}, {kept} kept"
+        )
+    target.flush()
+    return read, kept
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Filter, align and decimate a trace store into a new one",
+    )
+    parser.add_argument("source", help="Trace store to read")
+    parser.add_argument("target", help="Trace store to create or append to")
+    parser.add_argument(
+        "--reference",
+        type=int,
+        default=0,
+        help="Trace in the source to align against",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        nargs=2,
+        metavar=("START", "STOP"),
+        help="Samples of the reference to match (default: all but --max-shift"
+        " samples at each end)",
+    )
+    parser.add_argument(
+        "--max-shift",
+        type=int,
+        default=0,
+        help="Largest shift in samples to try when aligning (0 disables alignment)",
+    )
+    parser.add_argument(
+        "--band",
+        type=float,
+        nargs=2,
+        metavar=("LOW", "HIGH"),
+        help="Pass band as fractions of the sample rate, between 0 and 0.5",
+    )
+    parser.add_argument(
+        "--decimate", type=int, default=1, help="Average every this many samples"
+    )
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=-1.0,
+        help="Drop traces whose best alignment correlates less than this (-1 to 1)",
+    )
+    args = parser.parse_args()
+
+    source = TraceStore(args.source)
+    if not 0 <= args.reference < len(source):
+        parser.error(f"{args.source} has no trace {args.reference}")
+    preprocessor = Preprocessor(
+        source[args.reference],
+        args.window,
+        args.max_shift,
+        args.band,
+        args.decimate,
+    )
+    samples = source.samples // args.decimate
+    target = TraceStore(args.target, samples, "float32", source.index["chunk_traces"])
+    read, kept = preprocess_store(source, target, preprocessor, args.min_score)
+    print(f"Kept {kept} of {read} traces, {samples} samples each, in {args.target}")
@@ -17,9 +17,14 @@ import logging
 import inspect
 import subprocess
 import asyncio
+import hashlib
+import json
+import re
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import load_fleet
 import load_image
 import serial_socket_bridge
 
@@ -28,6 +33,12 @@ log = logging.getLogger(Path(__file__).name)
 
 ROOT_PATH = Path(__file__, "..", "..").resolve()
 
+# label holding the fingerprint of the inputs an image was built from
+BUILD_LABEL = "saffire.build"
+
+# folders the Dockerfiles ADD, relative to the repo root
+BUILD_FOLDERS = ["bootloader", "host_tools", "platform"]
+
 
 def make_dirs(dir_list):
     for path in dir_list:
@@ -39,6 +50,8 @@ def clear_dir(d):
     if p.exists():
         for item in Path(d).iterdir():
             if item.is_dir():
+                # e.g. the socket directory of each emulator in a pool
+                clear_dir(item)
                 Path.rmdir(item)
             else:
                 Path.unlink(item)
@@ -48,6 +61,52 @@ def get_volume(sysname, volume):
     return f"{sysname}-{volume}.vol"
 
 
+def copy_volume(src, dst, image):
+    # replace dst with a copy of src, by way of a throwaway container
+    subprocess.run(["docker", "volume", "rm", f"{dst}"], capture_output=True)
+    cmd = [
+        "docker",
+        "run",
+        "--rm",
+        "-v",
+        f"{src}:/from",
+        "-v",
+        f"{dst}:/to",
+        f"{image}",
+        "cp",
+        "-a",
+        "/from/.",
+        "/to/",
+    ]
+    subprocess.run(cmd)
+
+
+def pool_instance(sock_root, uart_sock, instance):
+    # emulator `instance` of a pool gets its own socket directory and UART port
+    return Path(sock_root, f"{instance}"), int(uart_sock) + instance
+
+
+def remove_pool_volumes(sysname):
+    # the copies of the device's memories that emulators of a pool ran on
+    cmd = ["docker", "volume", "ls", "-q", "--filter", f"name={sysname}-"]
+    volumes = subprocess.run(cmd, capture_output=True).stdout.decode("latin-1")
+    pattern = re.compile(rf"{re.escape(sysname)}-\d+-(flash|eeprom)\.vol")
+    pool = [volume for volume in volumes.split() if pattern.fullmatch(volume)]
+    if pool:
+        subprocess.run(["docker", "volume", "rm"] + pool, capture_output=True)
+
+
+def wait_for_file(path, timeout=10):
+    # poll for a file another process creates when it is ready
+    deadline = time.monotonic() + timeout
+    while not Path(path).exists():
+        if time.monotonic() > deadline:
+            log.warning(f"Gave up waiting for {path} after {timeout} seconds")
+            return False
+        time.sleep(0.05)
+    return True
+
+
 async def run_asyncio_subprocess(cmd, capture_stdout=False, capture_stderr=False):
     stdout = None
     stderr = None
@@ -64,6 +123,61 @@ async def run_asyncio_subprocess(cmd, capture_stdout=False, capture_stderr=False
     return proc
 
 
+async def relay_output(name, stream):
+    # collect a build's output, showing each line tagged with the build's name
+    lines = []
+    async for line in stream:
+        lines.append(line)
+        if __name__ == "__main__":
+            print(f"[{name}] {line.decode('latin-1').rstrip()}", flush=True)
+    return b"".join(lines)
+
+
+async def run_build(name, cmd, procs):
+    # one build, registered in procs so a failing build can stop it
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    procs[name] = proc
+    stdout, stderr = await asyncio.gather(
+        relay_output(name, proc.stdout), relay_output(name, proc.stderr)
+    )
+    await proc.wait()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+async def run_builds(builds):
+    # run independent builds side by side; the first to fail stops the others
+    procs = {}
+    stopped = []
+
+    async def run(name, cmd):
+        result = await run_build(name, cmd, procs)
+        if result.returncode != 0 and name not in stopped:
+            log.error(f"Building {name} failed, stopping the other builds")
+            for other, proc in procs.items():
+                if proc.returncode is None:
+                    stopped.append(other)
+                    proc.terminate()
+        return result
+
+    return await asyncio.gather(*(run(name, cmd) for name, cmd in builds.items()))
+
+
+async def build_images(host_cmd, device_cmds):
+    # The device images are built from host_tools, and only from it. Either
+    # way there is one result per image, the skipped ones failed.
+    host = await run_build("host_tools", host_cmd, {})
+    if host.returncode != 0:
+        log.error("Building host_tools failed, not building the device images")
+        skipped = b"Not built: building host_tools failed\n"
+        return [host] + [
+            subprocess.CompletedProcess(cmd, 1, b"", skipped)
+            for cmd in device_cmds.values()
+        ]
+    return [host] + await run_builds(device_cmds)
+
+
 def run_subprocess_capture(cmd):
     capture_output = False
 
@@ -137,6 +251,7 @@ def kill_bootloader(sysname):
 def kill_system(args):
     # Kill the bootloader
     kill_bootloader(args.sysname)
+    remove_pool_volumes(args.sysname)
 
     # Stop running host_tools containers
     cmd = ["docker", "ps", "-q", "--filter", f"ancestor={args.sysname}/host_tools"]
@@ -168,6 +283,58 @@ def kill_system(args):
     log.info("All system containers stopped and removed")
 
 
+def build_fingerprint(args, parents):
+    # sha256 over the Dockerfiles, every file the builds ADD and the build
+    # arguments; parents covers --base-image and emulated vs physical
+    root = Path(args.root_path)
+    inputs = [
+        root / "dockerfiles" / "1_build_saffire.Dockerfile",
+        root / "dockerfiles" / "2_create_device.Dockerfile",
+    ]
+    for folder in BUILD_FOLDERS:
+        files = (path for path in (root / folder).rglob("*") if path.is_file())
+        inputs += sorted(files)
+
+    digest = hashlib.sha256()
+    for path in inputs:
+        name = path.relative_to(root).as_posix()
+        mode = path.stat().st_mode & 0o777
+        content = hashlib.sha256(path.read_bytes()).hexdigest()
+        digest.update(f"{name} {mode:o} {content}\n".encode())
+    build_args = [args.oldest_allowed_version, args.eeprom_secret, list(parents)]
+    digest.update(json.dumps(build_args).encode())
+    return digest.hexdigest()
+
+
+def image_created(created):
+    # docker trims trailing zeros off the nanoseconds, so pad them back to
+    # compare timestamps as strings
+    date, _, fraction = created.rstrip("Z").partition(".")
+    return date, fraction.ljust(9, "0")
+
+
+def cached_build(args, fingerprint):
+    # whether all three images were built from these inputs, by the same run:
+    # the device images copy the bootloader, and its secrets, out of host_tools,
+    # so they must be newer than it
+    images = ["host_tools", "bootloader:base", "bootloader:sc"]
+    cmd = [
+        "docker",
+        "image",
+        "inspect",
+        "--format",
+        f'{{{{index .Config.Labels "{BUILD_LABEL}"}}}} {{{{.Created}}}}',
+    ] + [f"{args.sysname}/{image}" for image in images]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return False
+    stamps = [line.split(" ", 1) for line in result.stdout.splitlines()]
+    if [label for label, _ in stamps] != [fingerprint] * len(images):
+        return False
+    host = image_created(stamps[0][1])
+    return all(image_created(created) >= host for _, created in stamps[1:])
+
+
 def build_system(args):
     # Check for type
     if args.physical:
@@ -179,17 +346,11 @@ def build_system(args):
     else:
         exit("build_system: Missing '--emulated' or '--physical'")
 
-    # Get Docker-managed volumes
-    secrets_root = get_volume(args.sysname, "secrets")
-
-    log.info("Removing system volumes (if they exist)")
-
-    # Remove the old secrets
-    cmd = ["docker", "volume", "rm", f"{secrets_root}"]
-    subprocess.run(cmd)
+    # Label the images with the fingerprint of what they are built from
+    fingerprint = build_fingerprint(args, (parent, parent_sc))
 
     # Build host tools
-    cmd = [
+    host_cmd = [
         "docker",
         "build",
         "--progress",
@@ -199,17 +360,17 @@ def build_system(args):
         f"{args.root_path}/dockerfiles/1_build_saffire.Dockerfile",
         "-t",
         f"{args.sysname}/host_tools",
+        "--label",
+        f"{BUILD_LABEL}={fingerprint}",
         "--build-arg",
         f"OLDEST_VERSION={args.oldest_allowed_version}",
     ]
     # Choose whether to force a full container build
     if args.no_cache:
-        cmd.append("--no-cache")
-
-    p1 = run_subprocess_capture(cmd)
+        host_cmd.append("--no-cache")
 
     # Build device
-    cmd = [
+    base_cmd = [
         "docker",
         "build",
         "--progress",
@@ -219,6 +380,8 @@ def build_system(args):
         f"{args.root_path}/dockerfiles/2_create_device.Dockerfile",
         "-t",
         f"{args.sysname}/bootloader:base",
+        "--label",
+        f"{BUILD_LABEL}={fingerprint}",
         "--build-arg",
         f"SYSNAME={args.sysname}",
         "--build-arg",
@@ -226,10 +389,9 @@ def build_system(args):
         "--build-arg",
         f"EEPROM_SECRET={args.eeprom_secret}",
     ]
-    p2 = run_subprocess_capture(cmd)
 
     # Build device copy with side-channel emulator
-    cmd = [
+    sc_cmd = [
         "docker",
         "build",
         "--progress",
@@ -239,6 +401,8 @@ def build_system(args):
         f"{args.root_path}/dockerfiles/2_create_device.Dockerfile",
         "-t",
         f"{args.sysname}/bootloader:sc",
+        "--label",
+        f"{BUILD_LABEL}={fingerprint}",
         "--build-arg",
         f"SYSNAME={args.sysname}",
         "--build-arg",
@@ -246,11 +410,39 @@ def build_system(args):
         "--build-arg",
         f"EEPROM_SECRET={args.eeprom_secret}",
     ]
-    p3 = run_subprocess_capture(cmd)
+
+    # Reuse the images if nothing they are built from has changed, keeping the
+    # secrets volume that goes with them. Each step reports success, as if
+    # it had been built.
+    if not args.no_cache and cached_build(args, fingerprint):
+        log.info(
+            f"Reused cached build of {args.sysname} (fingerprint"
+            f" {fingerprint[:12]}); use --no-cache to rebuild"
+        )
+        steps = [host_cmd, base_cmd, sc_cmd]
+        return [subprocess.CompletedProcess(cmd, 0, b"", b"") for cmd in steps]
+
+    # Session containers would keep running the old host_tools image, and
+    # keep the secrets volume in use
+    stop_session(args)
+
+    # Get Docker-managed volumes
+    secrets_root = get_volume(args.sysname, "secrets")
+
+    log.info("Removing system volumes (if they exist)")
+
+    # Remove the old secrets
+    cmd = ["docker", "volume", "rm", f"{secrets_root}"]
+    subprocess.run(cmd)
+
+    # The two device builds only share host_tools, so they run side by side
+    # once it is built
+    device_cmds = {"bootloader:base": base_cmd, "bootloader:sc": sc_cmd}
+    results = asyncio.run(build_images(host_cmd, device_cmds))
 
     # "docker volume rm <secrets volume>" was returning an error code when the volume didn't exist
     # not going to check the returncode of this
-    return [p1, p2, p3]
+    return results
 
 
 def load_emulated_device(args):
@@ -318,7 +510,14 @@ def load_physical_device(args):
     cmd = ["docker", "rm", "-v", f"{container_id}"]
     subprocess.run(cmd)
 
-    if load_image.load(f"{args.sysname}-bl_image.bin.deleteme") != 0:
+    image = f"{args.sysname}-bl_image.bin.deleteme"
+    if args.serial_port or args.boards > 1:
+        # Load every board at once from the same image
+        results = load_fleet.load_fleet(image, args.serial_port, args.boards)
+        if not results or not all(result.ok for result in results):
+            log.error("load_device: Physical device load failed")
+            raise RuntimeError("load_device: Physical device load failed")
+    elif load_image.load(image) != 0:
         log.error("load_device: Physical device load failed")
         raise RuntimeError("load_device: Physical device load failed")
 
@@ -336,16 +535,28 @@ def load_device(args):
     log.info("Loaded SAFFIRe bootloader into device")
 
 
-def launch_emulator(args, interactive=False, do_gdb=False, do_sc=False):
+def launch_emulator(args, interactive=False, do_gdb=False, do_sc=False, instance=None):
 
     # Need abspath for local folder to mount as a Docker volume
     sock_root = Path(args.sock_root).resolve()
-    make_dirs([sock_root])
+    uart_sock = args.uart_sock
+    container = f"{args.sysname}-bootloader"
 
     # Get Docker-managed volumes
     flash_root = get_volume(args.sysname, "flash")
     eeprom_root = get_volume(args.sysname, "eeprom")
 
+    # Emulators of a pool after the first run on the copies of the device's
+    # memories launch_bootloader_sc made, so they never write to the same files
+    if instance is not None:
+        sock_root, uart_sock = pool_instance(sock_root, uart_sock, instance)
+        container = f"{container}-{instance}"
+        if instance > 0:
+            flash_root = get_volume(f"{args.sysname}-{instance}", "flash")
+            eeprom_root = get_volume(f"{args.sysname}-{instance}", "eeprom")
+
+    make_dirs([sock_root])
+
     if interactive:
         dock_opt = "-i"
     else:
@@ -370,7 +581,7 @@ def launch_emulator(args, interactive=False, do_gdb=False, do_sc=False):
         "run",
         f"{dock_opt}",
         "-p",
-        f"{args.uart_sock}:{args.uart_sock}",
+        f"{uart_sock}:{uart_sock}",
         "--add-host=host.docker.internal:host-gateway",
         "-v",
         f"{sock_root}:/external_socks",
@@ -379,20 +590,25 @@ def launch_emulator(args, interactive=False, do_gdb=False, do_sc=False):
         "-v",
         f"{eeprom_root}:/eeprom",
         "--name",
-        f"{args.sysname}-bootloader",
+        f"{container}",
         f"{args.sysname}/bootloader:{tag}",
         "sh",
         "/platform/launch_platform.sh",
         "--uart_sock",
-        f"{args.uart_sock}",
+        f"{uart_sock}",
         "--side-channel",
         f"{sc_arg}",
         "--gdb",
         f"{gdb_arg}",
     ]
+    ready_file = sock_root / "ready"
+    if ready_file.exists():
+        ready_file.unlink()
     subprocess.run(cmd)
-    # Wait for a few seconds
-    time.sleep(2)
+
+    # Wait for the emulator to connect to the bootloader interface
+    if not interactive:
+        wait_for_file(ready_file)
 
     if do_gdb:
         # Copy bootloader.elf from the bootloader container to the local filesystem
@@ -435,6 +651,9 @@ def launch_emulator(args, interactive=False, do_gdb=False, do_sc=False):
 
 
 def launch_bootloader_bridge(args):
+    # Keep terminal output off the bridge's data path
+    serial_socket_bridge.queue_logging()
+
     # Launch bridge (takes up terminal)
     serial_socket_bridge.bridge(args.uart_sock, args.serial_port)
 
@@ -468,7 +687,120 @@ def launch_bootloader_gdb(args):
 def launch_bootloader_sc(args):
     if args.sock_root is None:
         exit("launch_bootloader_sc: Missing '--sock-root' for emulated flow")
-    launch_emulator(args, do_sc=True)
+    if args.instances == 1:
+        launch_emulator(args, do_sc=True)
+        return
+
+    # Copy the device's memories for every emulator after the first before
+    # any of them starts, as the first writes to the originals once running
+    image = f"{args.sysname}/bootloader:sc"
+    for instance in range(1, args.instances):
+        for memory in ("flash", "eeprom"):
+            copy_volume(
+                get_volume(args.sysname, memory),
+                get_volume(f"{args.sysname}-{instance}", memory),
+                image,
+            )
+
+    # Start a pool side by side, each emulator waiting for its own ready file
+    def launch(instance):
+        launch_emulator(args, do_sc=True, instance=instance)
+
+    with ThreadPoolExecutor(max_workers=args.instances) as pool:
+        list(pool.map(launch, range(args.instances)))
+    log.info(
+        f"Launched {args.instances} side-channel emulators: UART ports"
+        f" {args.uart_sock} and up, sockets in {args.sock_root}/<instance>"
+    )
+
+
+def get_session(sysname, kind):
+    return f"{sysname}-host_tools-{kind}"
+
+
+def stop_session(args):
+    for kind in ("secrets", "device"):
+        cmd = ["docker", "rm", "-f", get_session(args.sysname, kind)]
+        subprocess.run(cmd, capture_output=True)
+
+
+def start_session(args):
+    # Keep host_tools containers running, so each tool is a "docker exec"
+    # instead of a new container. The "secrets" container runs the tools that
+    # use the secrets; the "device" container has them removed, like the
+    # containers of the tools that talk to the device.
+    stop_session(args)
+
+    # Need abspath for local folder to mount as a Docker volume
+    fw_root = Path(args.fw_root).resolve()
+    cfg_root = Path(args.cfg_root).resolve()
+    make_dirs([fw_root, cfg_root])
+
+    # Get Docker-managed volumes
+    secrets_root = get_volume(args.sysname, "secrets")
+    msg_root = get_volume(args.sysname, "messages")
+
+    # Labels record the mounts, so commands using other folders do not use it
+    common = [
+        "--add-host=host.docker.internal:host-gateway",
+        "--add-host",
+        "saffire-net:host-gateway",
+        "-v",
+        f"{fw_root}:/firmware",
+        "-v",
+        f"{cfg_root}:/configuration",
+        "--label",
+        f"saffire.fw_root={fw_root}",
+        "--label",
+        f"saffire.cfg_root={cfg_root}",
+    ]
+    sessions = {
+        "secrets": (["-v", f"{secrets_root}:/secrets"], ["sleep", "infinity"]),
+        "device": (
+            ["-v", f"{msg_root}:/messages"],
+            ["/bin/bash", "-c", "rm -rf /secrets; exec sleep infinity"],
+        ),
+    }
+    for kind, (volumes, entry) in sessions.items():
+        name = get_session(args.sysname, kind)
+        cmd = ["docker", "run", "-d", "--name", name] + common + volumes
+        cmd += [f"{args.sysname}/host_tools"] + entry
+        subprocess.run(cmd, capture_output=True, check=True)
+
+    log.info(f"Started host_tools session for {args.sysname}")
+
+
+async def session_exec(args, kind, **roots):
+    # "docker exec" prefix for the running session container of this kind, or
+    # None to use a new container. roots are the folders the command mounts.
+    name = get_session(args.sysname, kind)
+    proc = await asyncio.create_subprocess_exec(
+        "docker",
+        "inspect",
+        "--format",
+        "{{.State.Running}} {{json .Config.Labels}}",
+        name,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return None
+    running, labels = out.decode().split(" ", 1)
+    if running != "true":
+        return None
+
+    labels = json.loads(labels)
+    for root, path in roots.items():
+        if labels.get(f"saffire.{root}") != f"{Path(path).resolve()}":
+            log.warning(f"Session {name} mounts another {root}, not using it")
+            return None
+    return ["docker", "exec", "-i", name]
+
+
+def without_secrets(tool):
+    # run a tool in a new container after removing the secrets from it
+    return ["/bin/bash", "-c", f'"rm -rf /secrets; {" ".join(tool)}"']
 
 
 async def fw_protect(args):
@@ -479,16 +811,7 @@ async def fw_protect(args):
     fw_root = Path(args.fw_root).resolve()
     make_dirs([fw_root])
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host=host.docker.internal:host-gateway",
-        "-v",
-        f"{secrets_root}:/secrets",
-        "-v",
-        f"{fw_root}:/firmware",
-        f"{args.sysname}/host_tools",
+    tool = [
         "/host_tools/fw_protect",
         "--firmware",
         f"{args.raw_fw_file}",
@@ -499,6 +822,20 @@ async def fw_protect(args):
         "--output-file",
         f"{args.protected_fw_file}",
     ]
+    cmd = await session_exec(args, "secrets", fw_root=fw_root)
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host=host.docker.internal:host-gateway",
+            "-v",
+            f"{secrets_root}:/secrets",
+            "-v",
+            f"{fw_root}:/firmware",
+            f"{args.sysname}/host_tools",
+        ]
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -511,21 +848,26 @@ async def cfg_protect(args):
     cfg_root = Path(args.cfg_root).resolve()
     make_dirs([cfg_root])
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "-v",
-        f"{secrets_root}:/secrets",
-        "-v",
-        f"{cfg_root}:/configuration",
-        f"{args.sysname}/host_tools",
+    tool = [
         "/host_tools/cfg_protect",
         "--input-file",
         f"{args.raw_cfg_file}",
         "--output-file",
         f"{args.protected_cfg_file}",
     ]
+    cmd = await session_exec(args, "secrets", cfg_root=cfg_root)
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "-v",
+            f"{secrets_root}:/secrets",
+            "-v",
+            f"{cfg_root}:/configuration",
+            f"{args.sysname}/host_tools",
+        ]
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -536,22 +878,27 @@ async def fw_update(args):
 
     make_dirs([fw_root])
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host",
-        "saffire-net:host-gateway",
-        "-v",
-        f"{fw_root}:/firmware",
-        f"{args.sysname}/host_tools",
-        "/bin/bash",
-        "-c",
-        '"rm -rf /secrets; '
-        "/host_tools/fw_update "
-        f"--socket {args.uart_sock} "
-        f'--firmware-file {args.protected_fw_file}"',
+    tool = [
+        "/host_tools/fw_update",
+        "--socket",
+        f"{args.uart_sock}",
+        "--firmware-file",
+        f"{args.protected_fw_file}",
     ]
+    cmd = await session_exec(args, "device", fw_root=fw_root)
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host",
+            "saffire-net:host-gateway",
+            "-v",
+            f"{fw_root}:/firmware",
+            f"{args.sysname}/host_tools",
+        ]
+        tool = without_secrets(tool)
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -562,22 +909,27 @@ async def cfg_load(args):
 
     make_dirs([cfg_root])
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host",
-        "saffire-net:host-gateway",
-        "-v",
-        f"{cfg_root}:/configuration",
-        f"{args.sysname}/host_tools",
-        "/bin/bash",
-        "-c",
-        '"rm -rf /secrets ; '
-        "/host_tools/cfg_load "
-        f"--socket {args.uart_sock} "
-        f'--config-file {args.protected_cfg_file}"',
+    tool = [
+        "/host_tools/cfg_load",
+        "--socket",
+        f"{args.uart_sock}",
+        "--config-file",
+        f"{args.protected_cfg_file}",
     ]
+    cmd = await session_exec(args, "device", cfg_root=cfg_root)
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host",
+            "saffire-net:host-gateway",
+            "-v",
+            f"{cfg_root}:/configuration",
+            f"{args.sysname}/host_tools",
+        ]
+        tool = without_secrets(tool)
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -586,15 +938,7 @@ async def readback(args, rb_region):
     # Get Docker-managed volumes
     secrets_root = get_volume(args.sysname, "secrets")
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host",
-        "saffire-net:host-gateway",
-        "-v",
-        f"{secrets_root}:/secrets",
-        f"{args.sysname}/host_tools",
+    tool = [
         "/host_tools/readback",
         "--socket",
         f"{args.uart_sock}",
@@ -603,6 +947,19 @@ async def readback(args, rb_region):
         "--num-bytes",
         f"{args.rb_len}",
     ]
+    cmd = await session_exec(args, "secrets")
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host",
+            "saffire-net:host-gateway",
+            "-v",
+            f"{secrets_root}:/secrets",
+            f"{args.sysname}/host_tools",
+        ]
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stdout=True, capture_stderr=True)
     return result
 
@@ -619,22 +976,27 @@ async def boot(args):
     # Get Docker-managed volumes
     msg_root = get_volume(args.sysname, "messages")
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host",
-        "saffire-net:host-gateway",
-        "-v",
-        f"{msg_root}:/messages",
-        f"{args.sysname}/host_tools",
-        "/bin/bash",
-        "-c",
-        '"rm -rf /secrets; '
-        "/host_tools/boot "
-        f"--socket {args.uart_sock} "
-        f'--release-message-file {args.boot_msg_file}\"',
+    tool = [
+        "/host_tools/boot",
+        "--socket",
+        f"{args.uart_sock}",
+        "--release-message-file",
+        f"{args.boot_msg_file}",
     ]
+    cmd = await session_exec(args, "device")
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host",
+            "saffire-net:host-gateway",
+            "-v",
+            f"{msg_root}:/messages",
+            f"{args.sysname}/host_tools",
+        ]
+        tool = without_secrets(tool)
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -643,22 +1005,27 @@ async def monitor(args):
     # Get Docker-managed volumes
     msg_root = get_volume(args.sysname, "messages")
 
-    cmd = [
-        "docker",
-        "run",
-        "-i",
-        "--add-host",
-        "saffire-net:host-gateway",
-        "-v",
-        f"{msg_root}:/messages",
-        f"{args.sysname}/host_tools",
-        "/bin/bash",
-        "-c",
-        '"rm -rf /secrets ; '
-        "/host_tools/monitor "
-        f"--socket {args.uart_sock} "
-        f'--release-message-file {args.boot_msg_file}"',
+    tool = [
+        "/host_tools/monitor",
+        "--socket",
+        f"{args.uart_sock}",
+        "--release-message-file",
+        f"{args.boot_msg_file}",
     ]
+    cmd = await session_exec(args, "device")
+    if cmd is None:
+        cmd = [
+            "docker",
+            "run",
+            "-i",
+            "--add-host",
+            "saffire-net:host-gateway",
+            "-v",
+            f"{msg_root}:/messages",
+            f"{args.sysname}/host_tools",
+        ]
+        tool = without_secrets(tool)
+    cmd += tool
     result = await run_asyncio_subprocess(cmd, capture_stderr=True)
     return result
 
@@ -674,6 +1041,8 @@ def cleanup(args):
         if f_path.exists():
             f_path.unlink()
 
+        remove_pool_volumes(args.sysname)
+
     # Remove sockets
     if args.sock_root is not None:
         f_path = Path(args.sock_root)
@@ -716,7 +1085,7 @@ def get_args():
     parser_create.add_argument(
         "--no-cache",
         action="store_true",
-        help="Force a full build of the host_tools docker image",
+        help="Force a full build of the images, even if a cached build matches",
     )
     parser_create.add_argument(
         "--base-image",
@@ -740,7 +1109,15 @@ def get_args():
     parser_load = subparsers.add_parser("load-device", help="load-device help")
     parser_load.add_argument("--sysname", required=True, help="SAFFIRe system name")
     parser_load.add_argument(
-        "--serial-port", default=None, help="Physical device serial port"
+        "--serial-port",
+        action="append",
+        help="Physical device serial port (repeat to load several devices at once)",
+    )
+    parser_load.add_argument(
+        "--boards",
+        type=int,
+        default=1,
+        help="Number of physical devices to wait for and load at once",
     )
     load_group = parser_load.add_mutually_exclusive_group(required=True)
     load_group.add_argument(
@@ -811,6 +1188,13 @@ def get_args():
     parser_bl_sc.add_argument(
         "--uart-sock", required=True, help="UART interface socket"
     )
+    parser_bl_sc.add_argument(
+        "--instances",
+        type=int,
+        default=1,
+        help="Emulators to start; instance N uses UART socket --uart-sock + N"
+        " and sockets in <sock-root>/N",
+    )
     parser_bl_sc.set_defaults(func=launch_bootloader_sc)
 
     # Firmware protect
@@ -955,6 +1339,28 @@ def get_args():
     )
     parser_printmsg.set_defaults(func=get_release_message)
 
+    # Start long-lived host_tools containers
+    parser_session = subparsers.add_parser(
+        "start-session", help="start-session help"
+    )
+    parser_session.add_argument("--sysname", required=True, help="SAFFIRe system name")
+    parser_session.add_argument(
+        "--fw-root", required=True, help="Directory of firmware images"
+    )
+    parser_session.add_argument(
+        "--cfg-root", required=True, help="Directory of configuration images"
+    )
+    parser_session.set_defaults(func=start_session)
+
+    # Stop the host_tools containers
+    parser_stop_session = subparsers.add_parser(
+        "stop-session", help="stop-session help"
+    )
+    parser_stop_session.add_argument(
+        "--sysname", required=True, help="SAFFIRe system name"
+    )
+    parser_stop_session.set_defaults(func=stop_session)
+
     # Clean up temporary files
     parser_cleanup = subparsers.add_parser("cleanup", help="cleanup help")
     parser_cleanup.add_argument("--sysname", help="SAFFIRe system name")
@@ -18,6 +18,12 @@ import argparse
 import socket
 import time
 import os
+from typing import Iterable, Iterator, Optional
+
+
+# seconds a campaign waits for the bootloader's answer, and for a trace's
+# samples, before giving up on the trace
+RESPONSE_TIMEOUT = 5.0
 
 
 def parse_args():
@@ -33,11 +39,9 @@ def parse_args():
         "--sc-sock", help="Path to the side channel socket", required=True
     )
     parser.add_argument(
-        "--i-file", help="Name of the file to load 16 bytes of data from", required=True
-    )
-    parser.add_argument(
-        "--o-file", help="Name of the file to print sc data to", required=True
+        "--i-file", help="Name of the file to load 16 bytes of data from"
     )
+    parser.add_argument("--o-file", help="Name of the file to print sc data to")
     parser.add_argument(
         "--byte-skip-count",
         default=-1,
@@ -52,32 +56,310 @@ def parse_args():
         help="Maximum number of samples per trace",
         required=True,
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--campaign",
+        action="store_true",
+        help="Collect one trace per 16-byte plaintext over one session, appending"
+        " traces to --o-file and plaintexts to <o-file>.plaintexts",
+    )
+    parser.add_argument(
+        "--num-traces",
+        type=int,
+        help="Number of traces to collect in a campaign (default: every plaintext"
+        " in --i-file)",
+    )
+    parser.add_argument(
+        "--random-plaintexts",
+        action="store_true",
+        help="Generate random plaintexts for a campaign instead of reading --i-file",
+    )
+    parser.add_argument(
+        "--batch-traces",
+        type=int,
+        default=64,
+        help="Traces buffered in memory between writes in a campaign",
+    )
+    parser.add_argument(
+        "--store",
+        help="Append a campaign to this trace store directory (see trace_store.py)"
+        " instead of --o-file",
+    )
+    parser.add_argument(
+        "--tvla",
+        action="store_true",
+        help="Send the fixed TVLA plaintext or a random one, chosen at random for"
+        " each trace, and run a fixed-vs-random t-test during the campaign",
+    )
+    parser.add_argument(
+        "--assess",
+        action="store_true",
+        help="Update the per-sample SNR (and t-test with --tvla) as traces arrive"
+        " and report it with the campaign progress",
+    )
+    parser.add_argument(
+        "--stop-t",
+        type=float,
+        help="Stop the campaign once some sample's |t| reaches this (4.5 is the"
+        " usual TVLA threshold); implies --assess, needs --tvla",
+    )
+    parser.add_argument(
+        "--stop-snr",
+        type=float,
+        help="Stop the campaign once some sample's SNR reaches this; implies --assess",
+    )
+    args = parser.parse_args()
+    if args.stop_t is not None and not args.tvla:
+        parser.error("--stop-t needs --tvla")
+    if not args.o_file and not (args.campaign and args.store):
+        parser.error("--o-file is required unless a campaign uses --store")
+    generated = args.random_plaintexts or args.tvla
+    if not args.i_file and not (args.campaign and generated):
+        parser.error(
+            "--i-file is required unless a campaign uses --random-plaintexts"
+            " or --tvla"
+        )
+    return args
 
 
 # Continuously collect side-channel traces
 # Save data when told to by the main thread
 def read_sc_data(sc_sock, o_file, start, stop, num_samples):
+    # Samples are received straight into a buffer allocated up front, so
+    # keeping up with the probe costs no allocation or file write per chunk
+    trace = bytearray(max(num_samples, 0))
+    view = memoryview(trace)
+    scratch = bytearray(65536)
+    collected = 0
+
     # Connect side-channel probe socket
     with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
         sock.connect(sc_sock)
-        samples_temp = num_samples
-        with open(o_file, "wb") as out_file:
-            # Continuosuly read data
-            while True:
-                data = sock.recv(1024)
 
-                # Only save data if the "start" event has been set
-                if start.isSet() and samples_temp > 0:
-                    if samples_temp < len(data):
-                        out_file.write(data[:samples_temp])
-                        samples_temp = 0
-                    else:
-                        out_file.write(data)
-                        samples_temp -= len(data)
+        # Continuosuly read data
+        while True:
+            # Only save data if the "start" event has been set; the rest is
+            # still drained so the probe never backs up
+            if start.is_set() and collected < len(trace):
+                n = sock.recv_into(view[collected:])
+                collected += n
+            else:
+                n = sock.recv_into(scratch)
+
+            if stop.is_set() or n == 0:
+                break
+
+    # Write the trace out in one go
+    with open(o_file, "wb") as out_file:
+        out_file.write(view[:collected])
+
+
+class TraceCollector:
+    """
+    Reads the side-channel stream continuously and cuts it into traces
+
+    arm() hands the reader the buffer for the next trace. Samples arriving
+    after that are copied into it until it is full, the same trigger the
+    single-trace collector uses, and everything else is dropped so the probe
+    never backs up. Samples are always received into the reader's own buffer
+    and copied under a lock, so a receive still in progress when wait() gives
+    up can never write into the trace armed after it.
+    """
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.row: Optional[memoryview] = None
+        self.filled = 0
+        self.done = threading.Event()
+        self.closed = False
+
+    def arm(self, row: memoryview):
+        with self.lock:
+            self.filled = 0
+            self.done.clear()
+            self.row = row
 
-                if stop.isSet():
-                    return
+    def wait(self, timeout: Optional[float] = None) -> int:
+        # samples captured for the armed trace
+        self.done.wait(timeout)
+        with self.lock:
+            self.row = None
+            return self.filled
+
+    def run(self):
+        scratch = bytearray(65536)
+        view = memoryview(scratch)
+        while True:
+            try:
+                n = self.sock.recv_into(scratch)
+            except OSError:
+                n = 0
+
+            # probe closed
+            if n == 0:
+                self.closed = True
+                self.done.set()
+                return
+
+            with self.lock:
+                row = self.row
+                if row is not None and self.filled < len(row):
+                    count = min(n, len(row) - self.filled)
+                    row[self.filled : self.filled + count] = view[:count]
+                    self.filled += count
+                    if self.filled == len(row):
+                        self.done.set()
+
+
+class Session:
+    """
+    UART and side-channel connections to one bootloader, kept open for traces
+    """
+    def __init__(self, uart_sock: int, sc_sock: str):
+        self.probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.probe.connect(sc_sock)
+        self.sock.connect(("0.0.0.0", uart_sock))
+        self.sock.settimeout(RESPONSE_TIMEOUT)
+        self.collector = TraceCollector(self.probe)
+        threading.Thread(target=self.collector.run, daemon=True).start()
+
+    def capture(self, text: bytes, row: memoryview, number: int) -> bool:
+        # fill row with the trace of one plaintext (zero padded if the probe
+        # fell short); False once either connection has closed or the
+        # bootloader stopped answering
+        # Capture from the next samples on, then send the plaintext
+        self.collector.arm(row)
+        try:
+            self.sock.sendall(text)
+
+            # Wait for response
+            data = self.sock.recv(1)
+        except socket.timeout:
+            print(f"Bootloader did not respond (trace {number})")
+            return False
+        if not data:
+            print("Bootloader closed the connection")
+            return False
+        if data[0] != 0x6:
+            print(f"Error. Bootloader did not respond with 0x6 (trace {number})")
+        samples = self.collector.wait(timeout=RESPONSE_TIMEOUT)
+        if samples < len(row):
+            print(f"Trace {number} only got {samples} samples")
+            row[samples:] = bytes(len(row) - samples)
+        if self.collector.closed:
+            print("Side-channel probe closed")
+            return False
+        return True
+
+    def close(self):
+        # wake the collector thread up so it can finish
+        try:
+            self.probe.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.probe.close()
+        self.sock.close()
+
+
+def file_plaintexts(i_file, byte_skip_count) -> Iterator[bytes]:
+    # every whole 16-byte plaintext after the skipped bytes, read in one go
+    with open(i_file, "rb") as in_file:
+        if byte_skip_count > 0:
+            in_file.seek(byte_skip_count)
+        data = in_file.read()
+    for i in range(0, len(data) - 15, 16):
+        yield data[i : i + 16]
+
+
+def random_plaintexts() -> Iterator[bytes]:
+    while True:
+        yield os.urandom(16)
+
+
+def tvla_plaintexts(fixed: bytes) -> Iterator[bytes]:
+    # fixed or random with equal odds, so both sets see the same drift
+    while True:
+        text = os.urandom(17)
+        yield fixed if text[16] & 1 else text[:16]
+
+
+def run_campaign(
+    session: Session,
+    plaintexts: Iterable[bytes],
+    o_file,
+    num_samples: int,
+    num_traces: Optional[int] = None,
+    batch_traces: int = 64,
+    store=None,
+    assessment=None,
+    stop_t: Optional[float] = None,
+    stop_snr: Optional[float] = None,
+) -> int:
+    # traces are captured through session, which is closed at the end, and
+    # appended to o_file as rows of num_samples bytes (zero padded if the
+    # probe fell short), and their plaintexts to <o_file>.plaintexts.
+    # Given a TraceStore, they go there instead, with plaintexts and times.
+    # Given a LeakageAssessment, each batch updates it, and the campaign ends
+    # once it reaches stop_t or stop_snr.
+    batch = bytearray(batch_traces * num_samples)
+    batch_view = memoryview(batch)
+    texts = bytearray()
+    times = []
+    collected = 0
+    rows = 0
+    started = time.perf_counter()
+
+    def flush():
+        if assessment is not None:
+            assessment.update(batch_view[: rows * num_samples], texts)
+        if store is not None:
+            store.append(
+                batch_view[: rows * num_samples],
+                plaintext=texts,
+                timestamp=times,
+            )
+        else:
+            with open(o_file, "ab") as out_file:
+                out_file.write(batch_view[: rows * num_samples])
+            with open(f"{o_file}.plaintexts", "ab") as text_file:
+                text_file.write(texts)
+        texts.clear()
+        times.clear()
+
+    try:
+        for text in plaintexts:
+            if num_traces is not None and collected >= num_traces:
+                break
+
+            row = batch_view[rows * num_samples : (rows + 1) * num_samples]
+            if not session.capture(text, row, collected):
+                break
+
+            texts += text
+            times.append(time.time())
+            rows += 1
+            collected += 1
+            if rows == batch_traces:
+                flush()
+                rows = 0
+                if assessment is not None and assessment.reached(stop_t, stop_snr):
+                    print(f"Target reached: {assessment.summary()}")
+                    break
+            if collected % 1000 == 0:
+                rate = collected / (time.perf_counter() - started)
+                status = f"Collected {collected} traces ({rate:.0f} traces/s)"
+                if assessment is not None:
+                    status += f": {assessment.summary()}"
+                print(status)
+    finally:
+        session.close()
+
+    flush()
+    if store is not None:
+        store.flush()
+    if assessment is not None:
+        print(f"Leakage after {assessment.traces} traces: {assessment.summary()}")
+    return collected
 
 
 # Function to skip `byte_skip_count` bytes and then read and return 16 bytes
@@ -98,6 +380,45 @@ def write_output_data(o_file, data):
 def main():
     args = parse_args()
 
+    if args.campaign:
+        assessment = None
+        if args.assess or args.tvla or args.stop_t or args.stop_snr:
+            # only campaigns that are assessed need numpy
+            from leakage import TVLA_FIXED, LeakageAssessment
+
+            fixed = TVLA_FIXED if args.tvla else None
+            assessment = LeakageAssessment(args.num_samples, fixed)
+        if args.tvla:
+            plaintexts = tvla_plaintexts(TVLA_FIXED)
+        elif args.random_plaintexts:
+            plaintexts = random_plaintexts()
+        else:
+            plaintexts = file_plaintexts(args.i_file, args.byte_skip_count)
+
+        # connect first, so a bootloader that is not up leaves no empty store
+        session = Session(args.uart_sock, os.path.abspath(args.sc_sock))
+        store = None
+        if args.store:
+            # only campaigns written to a store need numpy
+            from trace_store import TraceStore
+
+            store = TraceStore(args.store, args.num_samples)
+        print("Collecting traces...")
+        collected = run_campaign(
+            session,
+            plaintexts,
+            args.o_file,
+            args.num_samples,
+            args.num_traces,
+            args.batch_traces,
+            store,
+            assessment,
+            args.stop_t,
+            args.stop_snr,
+        )
+        print(f"Collected {collected} traces")
+        return
+
     uart_sock = args.uart_sock
     sc_sock = os.path.abspath(args.sc_sock)
     num_samples = args.num_samples
@@ -0,0 +1,286 @@
+# 2022 eCTF
+# Parallel Side-Channel Collector
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+from queue import Empty
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import run_saffire
+import sc_example
+from trace_store import TraceStore
+
+
+# seconds to wait for each worker to connect to its emulator
+START_TIMEOUT = 30.0
+
+# this worker process's connection to its emulator
+session: Optional[sc_example.Session] = None
+num_samples = 0
+
+
+def endpoints(uart_sock: int, sock_root, instances: int) -> List[Tuple[int, str]]:
+    # (UART port, probe socket) of each emulator launch-bootloader-sc started
+    if instances == 1:
+        return [(int(uart_sock), str(Path(sock_root, "sc_probe.sock").resolve()))]
+    pool = []
+    for instance in range(instances):
+        root, port = run_saffire.pool_instance(sock_root, uart_sock, instance)
+        pool.append((port, str(Path(root, "sc_probe.sock").resolve())))
+    return pool
+
+
+def shards(
+    plaintexts: Iterable[bytes], num_traces: Optional[int], shard_traces: int
+) -> Iterator[Tuple[int, bytes]]:
+    # (first trace number, plaintexts) in campaign order
+    plaintexts = iter(plaintexts)
+    first = 0
+    while num_traces is None or first < num_traces:
+        count = shard_traces
+        if num_traces is not None:
+            count = min(count, num_traces - first)
+        texts = b"".join(itertools.islice(plaintexts, count))
+        if not texts:
+            return
+        yield first, texts
+        first += len(texts) // 16
+
+
+def start_worker(queue, started, samples: int):
+    # Each worker takes one emulator for its lifetime and reports whether it
+    # connected. One that did not exits; the pool's replacement finds no
+    # emulator left and waits, idle, until the pool is closed.
+    global session, num_samples
+    endpoint = queue.get()
+    try:
+        session = sc_example.Session(*endpoint)
+    except OSError as e:
+        started.put(f"{endpoint}: {e}")
+        sys.exit(1)
+    num_samples = samples
+    started.put(None)
+
+
+def wait_for_workers(started, count: int) -> int:
+    # number of workers that connected; raises if none did
+    connected = 0
+    for _ in range(count):
+        try:
+            error = started.get(timeout=START_TIMEOUT)
+        except Empty:
+            error = f"no worker connected within {START_TIMEOUT:.0f} s"
+        if error:
+            print(f"Emulator unreachable: {error}")
+        else:
+            connected += 1
+    if not connected:
+        raise ConnectionError(f"None of the {count} emulators could be reached")
+    return connected
+
+
+def collect_shard(shard: Tuple[int, bytes]) -> Tuple[bytearray, bytes, List[float]]:
+    # traces, plaintexts and times of a shard; cut short if the emulator went
+    # away, which Session.capture reports
+    first, texts = shard
+    traces = bytearray(len(texts) // 16 * num_samples)
+    view = memoryview(traces)
+    times: List[float] = []
+    for number in range(len(texts) // 16):
+        row = view[number * num_samples : (number + 1) * num_samples]
+        text = texts[number * 16 : (number + 1) * 16]
+        if not session.capture(text, row, first + number):
+            break
+        times.append(time.time())
+    return traces[: len(times) * num_samples], texts[: len(times) * 16], times
+
+
+def collect_pool(
+    pool_endpoints: List[Tuple[int, str]],
+    plaintexts: Iterable[bytes],
+    store_root,
+    num_samples: int,
+    num_traces: Optional[int] = None,
+    shard_traces: int = 256,
+    assessment=None,
+    stop_t: Optional[float] = None,
+    stop_snr: Optional[float] = None,
+) -> int:
+    # Shards of the plaintexts go to whichever emulator is free, one worker
+    # process each, and come back in campaign order, so the store holds the
+    # same traces in the same order whatever the number of emulators. The
+    # store is only opened once some emulator is connected.
+    queue = multiprocessing.Queue()
+    for endpoint in pool_endpoints:
+        queue.put(endpoint)
+    started = multiprocessing.Queue()
+
+    collected = 0
+    reported = 0
+    with multiprocessing.Pool(
+        len(pool_endpoints), start_worker, (queue, started, num_samples)
+    ) as pool:
+        connected = wait_for_workers(started, len(pool_endpoints))
+        print(f"Collecting traces on {connected} emulators...")
+        store = TraceStore(store_root, num_samples)
+        began = time.perf_counter()
+        work = shards(plaintexts, num_traces, shard_traces)
+        for traces, texts, times in pool.imap(collect_shard, work):
+            texts = memoryview(texts)
+            store.append(traces, plaintext=texts, timestamp=times)
+            if assessment is not None:
+                assessment.update(traces, texts)
+            collected += len(times)
+
+            if collected - reported >= 1000:
+                rate = collected / (time.perf_counter() - began)
+                status = f"Collected {collected} traces ({rate:.0f} traces/s)"
+                if assessment is not None:
+                    status += f": {assessment.summary()}"
+                print(status)
+                reported = collected
+            if assessment is not None and assessment.reached(stop_t, stop_snr):
+                # leaving the pool stops the workers mid-shard
+                print(f"Target reached: {assessment.summary()}")
+                break
+
+    store.flush()
+    if assessment is not None:
+        print(f"Leakage after {assessment.traces} traces: {assessment.summary()}")
+    return collected
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Collect one campaign over a pool of side-channel emulators",
+    )
+    parser.add_argument(
+        "--uart-sock",
+        type=int,
+        required=True,
+        help="UART socket of the first emulator; emulator N uses this + N",
+    )
+    parser.add_argument(
+        "--sock-root",
+        required=True,
+        help="Socket directory given to launch-bootloader-sc",
+    )
+    parser.add_argument(
+        "--instances",
+        type=int,
+        default=1,
+        help="Emulators to use, as many as launch-bootloader-sc --instances started",
+    )
+    parser.add_argument(
+        "--sysname",
+        help="Launch the emulators of this system first, instead of attaching to"
+        " ones already running",
+    )
+    parser.add_argument(
+        "--store", required=True, help="Trace store to append the campaign to"
+    )
+    parser.add_argument(
+        "--num-samples", type=int, required=True, help="Samples per trace"
+    )
+    parser.add_argument(
+        "--num-traces",
+        type=int,
+        help="Number of traces to collect (default: every plaintext in --i-file)",
+    )
+    plaintext_source = parser.add_mutually_exclusive_group(required=True)
+    plaintext_source.add_argument(
+        "--i-file", help="File of 16-byte plaintexts, one per trace"
+    )
+    plaintext_source.add_argument(
+        "--random-plaintexts",
+        action="store_true",
+        help="Generate a random plaintext for each trace",
+    )
+    plaintext_source.add_argument(
+        "--tvla",
+        action="store_true",
+        help="Send the fixed TVLA plaintext or a random one for each trace, and"
+        " run a fixed-vs-random t-test",
+    )
+    parser.add_argument(
+        "--byte-skip-count",
+        type=int,
+        default=0,
+        help="Number of bytes to skip from the input file",
+    )
+    parser.add_argument(
+        "--shard-traces",
+        type=int,
+        default=256,
+        help="Traces an emulator collects per turn",
+    )
+    parser.add_argument(
+        "--assess",
+        action="store_true",
+        help="Report per-sample SNR (and t-test with --tvla) with the progress",
+    )
+    parser.add_argument(
+        "--stop-t", type=float, help="Stop once some sample's |t| reaches this"
+    )
+    parser.add_argument(
+        "--stop-snr", type=float, help="Stop once some sample's SNR reaches this"
+    )
+    args = parser.parse_args()
+    if args.num_traces is None and not args.i_file:
+        parser.error("--num-traces is required with generated plaintexts")
+    if args.stop_t is not None and not args.tvla:
+        parser.error("--stop-t needs --tvla")
+
+    if args.sysname:
+        logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+        run_saffire.launch_bootloader_sc(
+            argparse.Namespace(
+                sysname=args.sysname,
+                sock_root=args.sock_root,
+                uart_sock=args.uart_sock,
+                instances=args.instances,
+            )
+        )
+
+    assessment = None
+    if args.assess or args.tvla or args.stop_t or args.stop_snr:
+        from leakage import TVLA_FIXED, LeakageAssessment
+
+        fixed = TVLA_FIXED if args.tvla else None
+        assessment = LeakageAssessment(args.num_samples, fixed)
+    if args.tvla:
+        plaintexts = sc_example.tvla_plaintexts(TVLA_FIXED)
+    elif args.random_plaintexts:
+        plaintexts = sc_example.random_plaintexts()
+    else:
+        plaintexts = sc_example.file_plaintexts(args.i_file, args.byte_skip_count)
+
+    try:
+        collected = collect_pool(
+            endpoints(args.uart_sock, args.sock_root, args.instances),
+            plaintexts,
+            args.store,
+            args.num_samples,
+            args.num_traces,
+            args.shard_traces,
+            assessment,
+            args.stop_t,
+            args.stop_snr,
+        )
+    except ConnectionError as e:
+        parser.exit(1, f"{e}\n")
+    print(f"Collected {collected} traces")
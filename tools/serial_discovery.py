@@ -0,0 +1,146 @@
+# 2022 eCTF
+# Serial Port Discovery
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import time
+from typing import List, Optional, Set
+
+from serial.tools import list_ports
+
+
+log = logging.getLogger(__name__)
+
+# serial device nodes are created and removed in /dev as boards come and go
+WATCH_DIR = b"/dev"
+
+# from <sys/inotify.h>
+IN_ATTRIB = 0x004
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_ATTRIB | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def open_inotify(path: bytes) -> Optional[int]:
+    # inotify fd watching path, or None where inotify is unavailable
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, path, WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def current_ports() -> Set[str]:
+    return {port.device for port in list_ports.comports()}
+
+
+class PortWatcher:
+    """
+    Waits for serial ports to appear after the watcher was created
+
+    Ports are only rescanned when inotify reports a change in /dev. Where
+    inotify is unavailable, they are rescanned every `poll_interval` seconds.
+    Ports that go away leave the baseline, so a board that is replugged counts
+    as new.
+    """
+    def __init__(self, poll_interval: float = 0.25):
+        self.poll_interval = poll_interval
+        self.fd = open_inotify(WATCH_DIR)
+        self.baseline = current_ports()
+        if self.fd is None:
+            log.debug(f"inotify unavailable, polling every {poll_interval} s")
+
+    def __enter__(self) -> "PortWatcher":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wait_change(self, timeout: Optional[float]):
+        if self.fd is None:
+            if timeout is None:
+                timeout = self.poll_interval
+            time.sleep(min(timeout, self.poll_interval))
+            return
+
+        # sleep until /dev changes, then discard the events: a rescan is cheap
+        # next to how rarely boards come and go
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def wait_for(self, count: int = 1, timeout: Optional[float] = None) -> List[str]:
+        # returns the new ports once at least `count` have appeared, or the
+        # ones found so far when the timeout runs out
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ports = current_ports()
+            self.baseline &= ports
+            new_ports = sorted(ports - self.baseline)
+            if len(new_ports) >= count:
+                return new_ports
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return new_ports
+            self.wait_change(remaining)
+
+
+def wait_for_ports(count: int = 1, timeout: Optional[float] = None) -> List[str]:
+    with PortWatcher() as watcher:
+        return watcher.wait_for(count, timeout)
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # configure logging
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Wait for serial ports to be connected and print their names",
+    )
+    parser.add_argument(
+        "--count", type=int, default=1, help="Number of new ports to wait for"
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Seconds to wait before giving up"
+    )
+    args = parser.parse_args()
+
+    log.info(f"Waiting for {args.count} serial port(s). Connect the device(s).")
+    ports = wait_for_ports(args.count, args.timeout)
+    for port in ports:
+        print(port)
+    if len(ports) < args.count:
+        log.error(f"Only {len(ports)} of {args.count} port(s) appeared")
+        exit(1)
@@ -12,17 +12,59 @@
 # DO NOT CHANGE THIS FILE
 
 import argparse
+import atexit
+import json
 import logging
+import queue
 import socket
 import select
 import serial
-from typing import Optional
+import struct
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+log = logging.getLogger(__name__)
+
+# per-chunk debug trace, enabled with --trace
+TRACE = False
+
+# tcpi_data_segs_out is the u32 at this offset of Linux's struct tcp_info (4.6+)
+TCP_INFO_SIZE = 160
+TCP_INFO_DATA_SEGS_OUT = 156
+
+
+def queue_logging(logger: Optional[logging.Logger] = None) -> QueueListener:
+    # move the logger's handlers behind a queue and write from a listener
+    # thread, so a slow terminal or disk never stalls the bridge
+    if logger is None:
+        logger = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener.start()
+
+    # flush queued records on the way out
+    atexit.register(listener.stop)
+    return listener
 
 
 class Port:
-    def __init__(self, device_port: str, baudrate=115200, log_level=logging.INFO):
+    def __init__(
+        self,
+        device_port: str,
+        baudrate=115200,
+        log_level=logging.INFO,
+        timeout: Optional[float] = 0.1,
+    ):
         self.device_port = device_port
         self.baudrate = baudrate
+        self.timeout = timeout
         self.ser = None
 
         # Set up logger
@@ -34,7 +76,7 @@ class Port:
         if not self.ser:
             try:
                 ser = serial.Serial(
-                    self.device_port, baudrate=self.baudrate, timeout=0.1
+                    self.device_port, baudrate=self.baudrate, timeout=self.timeout
                 )
                 ser.reset_input_buffer()
                 self.ser = ser
@@ -56,6 +98,20 @@ class Port:
             self.close()
             return None
 
+    def read_available(self) -> Optional[bytes]:
+        if not self.active():
+            return None
+
+        try:
+            # wait for the first byte, then take everything that has arrived
+            msg = self.ser.read(1)
+            if msg != b"":
+                return msg + self.ser.read(self.ser.in_waiting)
+            return None
+        except (serial.SerialException, OSError):
+            self.close()
+            return None
+
     def send_msg(self, msg: bytes) -> bool:
         if not self.active():
             return False
@@ -69,12 +125,83 @@ class Port:
 
     def close(self):
         self.logger.warning(f"Connection closed on {self.device_port}")
-        self.ser = None
+        ser, self.ser = self.ser, None
+        if ser:
+            try:
+                ser.close()
+            except (serial.SerialException, OSError):
+                pass
+
+
+def tcp_segments_sent(sock: socket.SocketType) -> Optional[int]:
+    # data segments the kernel has sent on this connection, where it says
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_SIZE)
+    except (AttributeError, OSError):
+        return None
+    if len(info) < TCP_INFO_SIZE:
+        return None
+    return struct.unpack_from("I", info, TCP_INFO_DATA_SEGS_OUT)[0]
+
+
+class Coalescer:
+    """
+    Batches bytes bound for a host socket into larger sends
+
+    A flush thread sends the batch once `threshold` bytes are queued or the
+    oldest byte has waited `deadline` seconds, so a stream of single bytes
+    costs one segment per batch instead of one per byte.
+    """
+    def __init__(self, sock: "Sock", threshold=1024, deadline=0.002):
+        self.sock = sock
+        self.threshold = threshold
+        self.deadline = deadline
+        self.buf = bytearray()
+        self.first = 0.0
+        self.cond = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def write(self, msg: bytes):
+        with self.cond:
+            if not self.buf:
+                self.first = time.monotonic()
+            self.buf += msg
+            self.cond.notify()
+
+    def clear(self):
+        with self.cond:
+            self.buf.clear()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buf:
+                    self.cond.wait()
+
+                # wait for a full batch, but never past the oldest byte's deadline
+                while len(self.buf) < self.threshold:
+                    remaining = self.first + self.deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                msg = bytes(self.buf)
+                self.buf.clear()
+            self.sock.send_now(msg)
 
 
 class Sock:
-    def __init__(self, sock_port: int, q_len=1, log_level=logging.INFO):
+    def __init__(
+        self, sock_port: int, q_len=1, log_level=logging.INFO, nodelay=False
+    ):
         self.sock_port = sock_port
+        self.nodelay = nodelay
+        self.coalescer: Optional[Coalescer] = None
+
+        # sent to host clients, for rate reports
+        self.sends = 0
+        self.bytes_sent = 0
+        self.closed_segments = 0
+        self.last_report = (time.monotonic(), 0, 0)
 
         # Set up socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -92,12 +219,21 @@ class Sock:
         ready, _, _ = select.select([sock], [], [], 0)
         return bool(ready)
 
+    def accept(self):
+        csock, _ = self.sock.accept()
+        if self.nodelay:
+            csock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.csock = csock
+        self.logger.info(f"Connection opened on {self.sock_port}")
+
+    def coalesce(self, threshold: int, deadline: float):
+        self.coalescer = Coalescer(self, threshold, deadline)
+
     def active(self) -> bool:
         # Try to accept new client
         if not self.csock:
             if self.sock_ready(self.sock):
-                self.logger.info(f"Connection opened on {self.sock_port}")
-                self.csock, _ = self.sock.accept()
+                self.accept()
         return bool(self.csock)
 
     def read_msg(self) -> Optional[bytes]:
@@ -124,17 +260,98 @@ class Sock:
         if not self.active():
             return False
 
+        if self.coalescer:
+            self.coalescer.write(msg)
+            return True
+
         try:
             self.csock.sendall(msg)
+            self.sends += 1
+            self.bytes_sent += len(msg)
             return True
         except (ConnectionResetError, BrokenPipeError):
             # Cleanly handle forced closed connection
             self.close()
             return False
 
+    def send_client(self, msg: bytes) -> bool:
+        # like send_msg, but never accepts: data with no client is dropped
+        if self.coalescer and self.csock:
+            self.coalescer.write(msg)
+            return True
+        return self.send_now(msg)
+
+    def send_now(self, msg: bytes) -> bool:
+        # a failed send is left for the reading side to notice and close
+        csock = self.csock
+        if not csock:
+            return False
+        try:
+            csock.sendall(msg)
+        except OSError:
+            return False
+        self.sends += 1
+        self.bytes_sent += len(msg)
+        return True
+
+    def segments_sent(self) -> int:
+        # kernel segment counts where available, otherwise one per send
+        csock = self.csock
+        current = tcp_segments_sent(csock) if csock else 0
+        if current is None:
+            return self.sends
+        return self.closed_segments + current
+
+    def log_rates(self):
+        now = time.monotonic()
+        segments, sent = self.segments_sent(), self.bytes_sent
+        then, last_segments, last_sent = self.last_report
+        self.last_report = (now, segments, sent)
+        if sent == last_sent:
+            return
+        elapsed = now - then
+        segments -= last_segments
+        sent -= last_sent
+        self.logger.info(
+            f"Port {self.sock_port}: {sent / elapsed:.0f} bytes/s in "
+            f"{segments / elapsed:.1f} segments/s "
+            f"({sent / max(segments, 1):.1f} bytes/segment)"
+        )
+
     def close(self):
         self.logger.warning(f"Conection closed on {self.sock_port}")
-        self.csock = None
+        csock, self.csock = self.csock, None
+        if self.coalescer:
+            self.coalescer.clear()
+        if csock:
+            self.closed_segments += tcp_segments_sent(csock) or 0
+            csock.close()
+
+
+def open_host_sock(
+    sock_port: int, tcp_mode="default", coalesce_bytes=1024, coalesce_ms=2.0
+) -> Sock:
+    # latency mode sends each read straight away; throughput mode batches
+    # reads first and then sends straight away, without waiting on Nagle too
+    sock = Sock(sock_port, nodelay=tcp_mode != "default")
+    if tcp_mode == "throughput":
+        sock.coalesce(coalesce_bytes, coalesce_ms / 1000)
+    return sock
+
+
+def report_rates(socks: List[Sock], interval: float):
+    while True:
+        time.sleep(interval)
+        for sock in socks:
+            sock.log_rates()
+
+
+def start_reporting(socks: List[Sock], interval: float):
+    if interval > 0:
+        reporter = threading.Thread(
+            target=report_rates, args=(socks, interval), daemon=True
+        )
+        reporter.start()
 
 
 def poll_bridge(host_sock: Sock, device_port: Port):
@@ -145,6 +362,8 @@ def poll_bridge(host_sock: Sock, device_port: Port):
         if device_port.active():
             if msg is not None:
                 device_port.send_msg(msg)
+                if TRACE:
+                    log.debug(f"{len(msg)} bytes host -> {device_port.device_port}")
 
     if device_port.active():
         msg = device_port.read_msg()
@@ -153,12 +372,98 @@ def poll_bridge(host_sock: Sock, device_port: Port):
         if host_sock.active():
             if msg is not None:
                 host_sock.send_msg(msg)
+                if TRACE:
+                    log.debug(f"{len(msg)} bytes {device_port.device_port} -> host")
+
+
+class PumpBridge:
+    """
+    Full-duplex bridge with one blocking pump thread per direction
+
+    The device pump sleeps in the serial read until data arrives and then
+    takes everything waiting in one read; the host pump sleeps in accept and
+    recv. Neither direction waits on the other, and an idle line uses no CPU.
+    """
+    def __init__(
+        self, host_sock: Sock, device_port: Port, reopen_interval=0.5, chunk_size=4096
+    ):
+        self.host_sock = host_sock
+        self.device_port = device_port
+        self.reopen_interval = reopen_interval
+        self.chunk_size = chunk_size
+
+    def pump_device(self):
+        # only this thread opens and closes the serial port
+        while True:
+            if not self.device_port.active():
+                time.sleep(self.reopen_interval)
+                continue
+
+            msg = self.device_port.read_available()
+            if msg is None:
+                continue
+
+            # data with no host connected is dropped, and a closed connection
+            # is left for the host pump to notice
+            self.host_sock.send_client(msg)
+            if TRACE:
+                log.debug(f"{len(msg)} bytes {self.device_port.device_port} -> host")
+
+    def pump_host(self):
+        # only this thread accepts and closes host connections
+        while True:
+            self.host_sock.accept()
+            while True:
+                try:
+                    msg = self.host_sock.csock.recv(self.chunk_size)
+                except (ConnectionResetError, BrokenPipeError):
+                    msg = b""
 
-
-def bridge(uart_sock: int, device_port: str):
+                # Connection closed
+                if not msg:
+                    self.host_sock.close()
+                    break
+
+                # data with no device connected is dropped
+                ser = self.device_port.ser
+                if ser:
+                    try:
+                        ser.write(msg)
+                    except (serial.SerialException, OSError):
+                        # the device pump notices the lost port
+                        pass
+                if TRACE:
+                    port = self.device_port.device_port
+                    log.debug(f"{len(msg)} bytes host -> {port}")
+
+    def start(self):
+        for pump in (self.pump_device, self.pump_host):
+            threading.Thread(target=pump, daemon=True).start()
+
+    def run(self):
+        threading.Thread(target=self.pump_device, daemon=True).start()
+        self.pump_host()
+
+
+def load_port_map(port_map: Path) -> Dict[str, int]:
+    # port map is a JSON object of serial device -> TCP port, e.g.
+    # {"/dev/serial/by-id/usb-Texas_Instruments_...-if00": 1337, ...}
+    entries = json.loads(port_map.read_text())
+    return {device: int(port) for device, port in entries.items()}
+
+
+def bridge(
+    uart_sock: int, device_port: str, threaded=False, stats_interval=0.0, **host_options
+):
 
     # Open all sockets
-    uart_sock_obj = Sock(uart_sock)
+    uart_sock_obj = open_host_sock(uart_sock, **host_options)
+    start_reporting([uart_sock_obj], stats_interval)
+    if threaded:
+        # block in the serial read instead of timing out every 0.1 s
+        PumpBridge(uart_sock_obj, Port(device_port, timeout=None)).run()
+        return
+
     device_port_obj = Port(device_port)
 
     # poll socket to serial bridge forever
@@ -166,12 +471,27 @@ def bridge(uart_sock: int, device_port: str):
         poll_bridge(uart_sock_obj, device_port_obj)
 
 
+def bridge_all(port_map: Dict[str, int], stats_interval=0.0, **host_options):
+    # bind every TCP port up front so a bad map fails before anything runs
+    bridges = [
+        PumpBridge(
+            open_host_sock(uart_sock, **host_options), Port(device_port, timeout=None)
+        )
+        for device_port, uart_sock in port_map.items()
+    ]
+    start_reporting([b.host_sock for b in bridges], stats_interval)
+
+    # each device is pumped on its own threads; unplugged devices are reopened
+    # by their pump as soon as they come back
+    for pump_bridge in bridges:
+        pump_bridge.start()
+    log.info(f"Bridging {len(bridges)} serial ports")
+    threading.Event().wait()
+
+
 # Run in application mode
 if __name__ == "__main__":
 
-    # Configure logging
-    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
-
     # Get arguments
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -180,9 +500,66 @@ if __name__ == "__main__":
         default=1337,
         help="Path to host-side data socket (will be created)",
     )
-    parser.add_argument("--device-port", required=True, help="Device-side serial port")
+    parser.add_argument("--device-port", help="Device-side serial port")
+    parser.add_argument(
+        "--port-map",
+        type=Path,
+        help="JSON object mapping serial ports to TCP ports, to bridge them all"
+        " from one process",
+    )
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="Pump each direction from its own blocking thread instead of polling",
+    )
+    parser.add_argument(
+        "--tcp-mode",
+        choices=("default", "latency", "throughput"),
+        default="default",
+        help="latency: TCP_NODELAY and send every read at once; throughput: batch"
+        " reads up to --coalesce-bytes or --coalesce-ms, then send",
+    )
+    parser.add_argument(
+        "--coalesce-bytes",
+        type=int,
+        default=1024,
+        help="Batch size at which throughput mode sends (default: 1024)",
+    )
+    parser.add_argument(
+        "--coalesce-ms",
+        type=float,
+        default=2.0,
+        help="Longest throughput mode holds a byte before sending (default: 2)",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=10.0,
+        help="Seconds between byte and segment rate reports (0 disables them)",
+    )
+    parser.add_argument("--trace", action="store_true", help="Log every bridged chunk")
     args = parser.parse_args()
+    if not args.device_port and not args.port_map:
+        parser.error("one of --device-port or --port-map is required")
 
-    uart_sock, device_port = args.uart_sock, args.device_port
-
-    bridge(uart_sock, device_port)
+    # Configure logging
+    TRACE = args.trace
+    logging.basicConfig(
+        level=logging.DEBUG if TRACE else logging.INFO,
+        format="%(levelname)-8s %(message)s",
+    )
+    queue_logging()
+
+    host_options = {
+        "tcp_mode": args.tcp_mode,
+        "coalesce_bytes": args.coalesce_bytes,
+        "coalesce_ms": args.coalesce_ms,
+    }
+    if args.port_map:
+        bridge_all(load_port_map(args.port_map), args.stats_interval, **host_options)
+    else:
+        uart_sock, device_port = args.uart_sock, args.device_port
+
+        bridge(
+            uart_sock, device_port, args.threaded, args.stats_interval, **host_options
+        )
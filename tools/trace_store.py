@@ -0,0 +1,250 @@
+# 2022 eCTF
+# Side-Channel Trace Store
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import argparse
+import bisect
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+INDEX_FILE = "index.json"
+
+# per-trace metadata kept next to the samples: name -> (row shape, dtype)
+COLUMNS: Dict[str, Tuple[Tuple[int, ...], str]] = {
+    "plaintext": ((16,), "uint8"),
+    "ciphertext": ((16,), "uint8"),
+    "timestamp": ((), "float64"),
+}
+
+
+class TraceStore:
+    """
+    Directory of fixed-shape trace chunks with per-trace metadata columns
+
+    Traces are appended in chunks of `chunk_traces` rows. Each chunk is one
+    .npy file per array (samples and every column), or one compressed .npz
+    file. index.json records where each chunk starts, so a trace or a range
+    only touches the chunks it falls in. Uncompressed chunks are memory-mapped
+    rather than read, so stores larger than RAM can be analysed chunk by chunk.
+    """
+    def __init__(
+        self,
+        root,
+        samples: Optional[int] = None,
+        dtype: str = "uint8",
+        chunk_traces: int = 1024,
+        compress: bool = False,
+    ):
+        self.root = Path(root)
+        index = self.root / INDEX_FILE
+        if index.exists():
+            self.index = json.loads(index.read_text())
+            if samples is not None and samples != self.index["samples"]:
+                raise ValueError(
+                    f"{self.root} holds {self.index['samples']}-sample traces,"
+                    f" not {samples}"
+                )
+        elif samples is None:
+            raise FileNotFoundError(f"No trace store at {self.root}")
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.index = {
+                "samples": samples,
+                "dtype": dtype,
+                "chunk_traces": chunk_traces,
+                "compress": compress,
+                "chunks": [],
+            }
+            self.write_index()
+
+        self.samples: int = self.index["samples"]
+        self.dtype = np.dtype(self.index["dtype"])
+        self.starts: List[int] = [chunk["start"] for chunk in self.index["chunks"]]
+        self.pending: List[Dict[str, np.ndarray]] = []
+        self.pending_traces = 0
+
+    def __enter__(self) -> "TraceStore":
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+    def __len__(self) -> int:
+        chunks = self.index["chunks"]
+        return chunks[-1]["start"] + chunks[-1]["count"] if chunks else 0
+
+    def reload(self):
+        # pick up chunks another process has written since
+        self.index = json.loads((self.root / INDEX_FILE).read_text())
+        self.starts = [chunk["start"] for chunk in self.index["chunks"]]
+
+    def write_index(self):
+        # replaced whole, so readers never see a half-written index
+        tmp = self.root / f".{INDEX_FILE}.tmp"
+        tmp.write_text(json.dumps(self.index, indent=1))
+        os.replace(tmp, self.root / INDEX_FILE)
+
+    def append(self, traces: np.ndarray, **columns: np.ndarray):
+        # traces is (n, samples); columns are any of COLUMNS with n rows each
+        traces = np.asarray(traces, dtype=self.dtype).reshape(-1, self.samples)
+        rows = {"traces": traces}
+        for name, values in columns.items():
+            shape, dtype = COLUMNS[name]
+            rows[name] = np.asarray(values, dtype=dtype).reshape(len(traces), *shape)
+
+        # every chunk holds the same arrays, fixed by the first append
+        names = sorted(rows)
+        if "arrays" not in self.index:
+            self.index["arrays"] = names
+        elif names != self.index["arrays"]:
+            raise ValueError(f"Expected {self.index['arrays']}, got {names}")
+
+        # copied, since callers often reuse their buffers
+        self.pending.append({name: array.copy() for name, array in rows.items()})
+        self.pending_traces += len(traces)
+        while self.pending_traces >= self.index["chunk_traces"]:
+            self.write_chunk(self.index["chunk_traces"])
+
+    def flush(self):
+        if self.pending_traces:
+            self.write_chunk(self.pending_traces)
+
+    def write_chunk(self, count: int):
+        # take `count` rows off the front of the pending appends
+        names = self.pending[0].keys()
+        merged = {
+            name: np.concatenate([rows[name] for rows in self.pending])
+            for name in names
+        }
+        chunk = {name: array[:count] for name, array in merged.items()}
+        rest = {name: array[count:] for name, array in merged.items()}
+        self.pending = [rest] if len(rest["traces"]) else []
+        self.pending_traces -= count
+
+        number = len(self.index["chunks"])
+        entry = {"start": len(self), "count": count}
+        if self.index["compress"]:
+            entry["file"] = f"chunk_{number:06d}.npz"
+            np.savez_compressed(self.root / entry["file"], **chunk)
+        else:
+            entry["file"] = f"chunk_{number:06d}"
+            for name, array in chunk.items():
+                np.save(self.root / f"{entry['file']}.{name}.npy", array)
+
+        self.index["chunks"].append(entry)
+        self.starts.append(entry["start"])
+        self.write_index()
+
+    def load_chunk(self, number: int, names=("traces",)) -> Dict[str, np.ndarray]:
+        entry = self.index["chunks"][number]
+        if entry["file"].endswith(".npz"):
+            with np.load(self.root / entry["file"]) as arrays:
+                return {name: arrays[name] for name in names}
+        return {
+            name: np.load(self.root / f"{entry['file']}.{name}.npy", mmap_mode="r")
+            for name in names
+        }
+
+    def read(
+        self, start: int, stop: Optional[int] = None, names=("traces",)
+    ) -> Dict[str, np.ndarray]:
+        # rows [start, stop) of the named arrays, from only the chunks they span
+        stop = len(self) if stop is None else min(stop, len(self))
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in names}
+        number = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        while number < len(self.starts) and self.starts[number] < stop:
+            first = self.starts[number]
+            arrays = self.load_chunk(number, names)
+            for name in names:
+                parts[name].append(arrays[name][max(start - first, 0) : stop - first])
+            number += 1
+        return {name: self.join(name, arrays) for name, arrays in parts.items()}
+
+    def join(self, name: str, arrays: List[np.ndarray]) -> np.ndarray:
+        # a range inside one chunk stays a view of it
+        if len(arrays) == 1:
+            return arrays[0]
+        if arrays:
+            return np.concatenate(arrays)
+        if name == "traces":
+            return np.empty((0, self.samples), self.dtype)
+        shape, dtype = COLUMNS[name]
+        return np.empty((0, *shape), dtype)
+
+    def traces(self, start: int, stop: Optional[int] = None) -> np.ndarray:
+        return self.read(start, stop)["traces"]
+
+    def __getitem__(self, trace: int) -> np.ndarray:
+        return self.traces(trace, trace + 1)[0]
+
+    def chunks(self, names=("traces",)) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+        # (first trace, arrays) for each chunk in order, for streaming analysis
+        for number, start in enumerate(self.starts):
+            yield start, self.load_chunk(number, names)
+
+
+def import_flat(o_file, store: TraceStore) -> int:
+    # load a campaign's flat --o-file (and its .plaintexts, if present)
+    traces = np.memmap(o_file, dtype=store.dtype, mode="r").reshape(-1, store.samples)
+    texts_file = Path(f"{o_file}.plaintexts")
+    texts = None
+    if texts_file.exists():
+        texts = np.fromfile(texts_file, dtype=np.uint8).reshape(-1, 16)
+    step = store.index["chunk_traces"]
+    for start in range(0, len(traces), step):
+        columns = {}
+        if texts is not None:
+            columns["plaintext"] = texts[start : start + step]
+        store.append(traces[start : start + step], **columns)
+    store.flush()
+    return len(traces)
+
+
+# Run in application mode
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Create or inspect a chunked side-channel trace store",
+    )
+    parser.add_argument("store", help="Trace store directory")
+    parser.add_argument(
+        "--import-flat",
+        help="Append the traces (and .plaintexts) of a flat sc_example output file",
+    )
+    parser.add_argument(
+        "--num-samples", type=int, help="Samples per trace, when creating a store"
+    )
+    parser.add_argument(
+        "--chunk-traces",
+        type=int,
+        default=1024,
+        help="Traces per chunk, when creating a store",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress chunks, when creating a store (they are then read whole"
+        " instead of memory-mapped)",
+    )
+    args = parser.parse_args()
+
+    store = TraceStore(
+        args.store, args.num_samples, "uint8", args.chunk_traces, args.compress
+    )
+    if args.import_flat:
+        print(f"Imported {import_flat(args.import_flat, store)} traces")
+    print(
+        f"{len(store)} traces of {store.samples} samples in"
+        f" {len(store.starts)} chunks"
+    )
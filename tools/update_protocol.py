@@ -0,0 +1,120 @@
+# 2022 eCTF
+# Bootloader Update Protocol Engine
+#
+# (c) 2022 The MITRE Corporation
+#
+# This source file is part of an example system for MITRE's 2022 Embedded System
+# CTF (eCTF). This code is being provided only for educational purposes for the
+# 2022 MITRE eCTF competition, and may not meet MITRE standards for quality.
+# Use this code at your own risk!
+
+import mmap
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+from serial import Serial
+
+
+BLOCK_SIZE = 16
+
+# what a status byte means, looked up in a 256-entry table
+IGNORE = 0
+OK = 1
+ERROR = 2
+
+
+def response_table(
+    ok: Iterable[int], error: Iterable[int] = (), others: int = ERROR
+) -> bytes:
+    # status byte -> OK / ERROR / IGNORE; bytes in neither list map to `others`
+    table = bytearray([others] * 256)
+    for code in error:
+        table[code] = ERROR
+    for code in ok:
+        table[code] = OK
+    return bytes(table)
+
+
+def read_image(in_file) -> memoryview:
+    # map the image instead of copying it; blocks are sent as slices of it
+    with open(Path(in_file), "rb") as image_fp:
+        try:
+            return memoryview(mmap.mmap(image_fp.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:
+            # empty files cannot be mapped
+            return memoryview(b"")
+
+
+class BlockStream:
+    """
+    Sends an image in fixed-size blocks, each answered by one status byte
+
+    Up to `window` blocks are kept in flight, and each status byte belongs to
+    the oldest unanswered block. Status bytes are read in bulk and classified
+    with a lookup table. Bytes the table marks IGNORE are skipped.
+    """
+    def __init__(
+        self,
+        ser: Serial,
+        image: memoryview,
+        block_size: int = BLOCK_SIZE,
+        window: int = 1,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.ser = ser
+        self.image = image
+        self.block_size = block_size
+        self.window = window
+        self.progress = progress
+        self.blocks = (len(image) + block_size - 1) // block_size
+        self.sent = 0
+        self.resp = b""
+
+    def send(self, responses: Union[bytes, Callable[[int], bytes]]) -> Optional[int]:
+        # responses is one table for every block, or gives each block's table.
+        # Returns the index of the first block that was not answered OK; the
+        # answer, if any, is left in self.resp.
+        ser, image, size, blocks = self.ser, self.image, self.block_size, self.blocks
+        window, progress = self.window, self.progress
+        per_block = callable(responses)
+        table = responses
+        pending, offset = b"", 0
+        sent = 0
+        for block in range(blocks):
+            while sent < blocks and sent - block < window:
+                ser.write(image[sent * size : (sent + 1) * size])
+                sent += 1
+            if per_block:
+                table = responses(block)
+
+            # next status byte the table does not ignore, reading in bulk but
+            # never past the answers still owed, so whatever the device sends
+            # after the last block stays in the port for the caller
+            while True:
+                if offset == len(pending):
+                    owed = sent - block
+                    if owed > 1:
+                        owed = min(max(ser.in_waiting, 1), owed)
+                    pending, offset = ser.read(owed), 0
+                    if not pending:
+                        # stop-and-wait can wait forever, but a silent device
+                        # with several blocks in flight has lost bytes
+                        if window == 1:
+                            continue
+                        status = -1
+                        break
+                status = pending[offset]
+                offset += 1
+                if table[status] != IGNORE:
+                    break
+
+            if status < 0 or table[status] != OK:
+                self.sent = sent
+                self.resp = b"" if status < 0 else bytes((status,))
+                return block
+
+            if progress:
+                progress(block + 1, blocks)
+
+        self.sent = sent
+        return None